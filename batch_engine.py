@@ -0,0 +1,352 @@
+"""
+Batch Tetris simulator
+Runs thousands of games at once. Every board is kept in one numpy array
+of shape (games, ROW_COUNT + 1, COL_COUNT) and each move, rotation, drop,
+lock and line clear is done to all of the games together, so the python
+code runs once per step instead of once per cell per game.
+
+Needs numpy - pip install numpy
+
+Run this file to benchmark it against TetrisEngine:
+python batch_engine.py --games 4096 --rounds 100
+"""
+import argparse
+import random
+import time
+
+import numpy as np
+
+from tetris_logic import (ROW_COUNT, COL_COUNT, SHAPES, ROTATION_TABLE, ROTATION_OFFSETS, ROTATION_LEFT_COLUMN,
+                          RANDOM, check_level, derive_seed, TetrisEngine)
+
+
+def create_cell_tables():
+    """
+    Works out the (row, column) of the 4 tiles in every shape at every rotation.
+    Returns two int arrays indexed by [shape index, rotation num, tile]
+    """
+    cell_rows = np.zeros((len(SHAPES), 4, 4), dtype=np.int64)
+    cell_cols = np.zeros((len(SHAPES), 4, 4), dtype=np.int64)
+    for piece, rotations in enumerate(ROTATION_TABLE):
+        for rotation, matrix in enumerate(rotations):
+            tiles = [(count_y, count_x) for count_y, row in enumerate(matrix)
+                     for count_x, tile in enumerate(row) if tile]
+            cell_rows[piece, rotation] = [tile[0] for tile in tiles]
+            cell_cols[piece, rotation] = [tile[1] for tile in tiles]
+    return cell_rows, cell_cols
+
+
+def get_level_up_scores():
+    """
+    Finds the score needed to go up from each level using check_level,
+    so the batch engine levels up exactly the same as the normal game.
+    Index is the level, the last level can't be left so it's never reached.
+    """
+    scores = [0]
+    level = 1
+    while True:
+        # Scores only go up in whole numbers so look for the first one that changes the level
+        score = next((score for score in range(100000) if check_level(level, score) != level), None)
+        if score is None:
+            break
+        scores.append(score)
+        level += 1
+    scores.append(np.iinfo(np.int64).max)
+    return np.array(scores, dtype=np.int64)
+
+
+CELL_ROWS, CELL_COLS = create_cell_tables()
+OFFSETS = np.array(ROTATION_OFFSETS, dtype=np.int64)
+LEFT_COLUMN = np.array(ROTATION_LEFT_COLUMN, dtype=np.int64)
+LEVEL_UP_SCORES = get_level_up_scores()
+
+
+class BatchEngine:
+    """
+    Lots of TetrisEngine games in numpy arrays.
+    Every method works on all the games at once, games that are over are left alone.
+    Shape positions use the same x, y as TetrisEngine.
+    """
+
+    def __init__(self, count, seed=None):
+        """ Initializer class. Call setup to start the games """
+        self.count = count
+        self.rng = np.random.default_rng(seed)
+
+        self.boards = None
+
+        self.piece = None
+        self.rotation = None
+        self.shape_x = None
+        self.shape_y = None
+        self.next_piece = None
+
+        self.game_over = None
+        self.level = None
+        self.score = None
+        self.lines = None
+        self.pieces = None
+
+    def setup(self, games=None):
+        """
+        Set up the games. Call to re-start them.
+        games is a bool array of which games to re-start, all of them if None
+        """
+        if games is None:
+            games = np.ones(self.count, dtype=bool)
+            # Boards have 0's, with 1's on the bottom for easier collision checking (like new_board)
+            self.boards = np.zeros((self.count, ROW_COUNT + 1, COL_COUNT), dtype=np.uint8)
+            self.piece = np.zeros(self.count, dtype=np.int64)
+            self.rotation = np.zeros(self.count, dtype=np.int64)
+            self.shape_x = np.zeros(self.count, dtype=np.int64)
+            self.shape_y = np.zeros(self.count, dtype=np.int64)
+            self.next_piece = np.zeros(self.count, dtype=np.int64)
+            self.game_over = np.zeros(self.count, dtype=bool)
+            self.level = np.zeros(self.count, dtype=np.int64)
+            self.score = np.zeros(self.count, dtype=np.int64)
+            self.lines = np.zeros(self.count, dtype=np.int64)
+            self.pieces = np.zeros(self.count, dtype=np.int64)
+
+        self.boards[games] = 0
+        self.boards[games, -1] = 1
+        self.game_over[games] = False
+        self.level[games] = 1
+        self.score[games] = 0
+        self.lines[games] = 0
+        self.pieces[games] = 0
+
+        self.next_piece[games] = self.rng.integers(0, len(SHAPES), games.sum())
+        self.new_shapes(games)
+
+    def new_shapes(self, games):
+        """ Randomly select new shapes for the games - create at top of screen"""
+        indexes = np.flatnonzero(games)
+        self.piece[indexes] = self.next_piece[indexes]
+        self.next_piece[indexes] = self.rng.integers(0, len(SHAPES), len(indexes))
+
+        # Work out the x value - take it from the middle of columns rounded to the left
+        widths = np.array([len(shape[0]) for shape in SHAPES])[self.piece[indexes]]
+        self.shape_x[indexes] = (COL_COUNT / 2 - widths + 1).astype(np.int64)
+        self.shape_y[indexes] = 0
+        self.rotation[indexes] = 0
+
+        # Collision checking for game over
+        over = self.check_collision(indexes, self.rotation[indexes], self.shape_x[indexes], self.shape_y[indexes])
+        self.game_over[indexes[over]] = True
+
+    def check_collision(self, indexes, rotation, shape_x, shape_y):
+        """
+        Checks if the falling shape of each game in indexes would hit anything
+        at the given rotation and x, y. Returns a bool array, one per game.
+        """
+        pieces = self.piece[indexes]
+        rows = CELL_ROWS[pieces, rotation] + shape_y[:, None]
+        cols = CELL_COLS[pieces, rotation] + shape_x[:, None]
+
+        # Off the board counts as a collision
+        outside = (rows < 0) | (rows > ROW_COUNT) | (cols < 0) | (cols >= COL_COUNT)
+        rows = np.clip(rows, 0, ROW_COUNT)
+        cols = np.clip(cols, 0, COL_COUNT - 1)
+        hits = self.boards[indexes[:, None], rows, cols] != 0
+        return (outside | hits).any(axis=1)
+
+    def active(self, games=None):
+        """ Indexes of the games in games (all if None) that aren't over """
+        if games is None:
+            return np.flatnonzero(~self.game_over)
+        return np.flatnonzero(games & ~self.game_over)
+
+    def move(self, x_values):
+        """
+        Move every game's shape across by its x_value (an int array, one per game).
+        Returns a bool array of which games moved
+        """
+        moved = np.zeros(self.count, dtype=bool)
+        indexes = self.active(x_values != 0)
+        new_x = self.shape_x[indexes] + x_values[indexes]
+        hit = self.check_collision(indexes, self.rotation[indexes], new_x, self.shape_y[indexes])
+        indexes = indexes[~hit]
+        self.shape_x[indexes] = new_x[~hit]
+        moved[indexes] = True
+        return moved
+
+    def rotate(self, games, rotate_anticlockwise=False):
+        """
+        Rotate the shapes of the games in games (a bool array) by one turn,
+        the same way as TetrisEngine.rotate. Returns a bool array of which games rotated
+        """
+        rotated = np.zeros(self.count, dtype=bool)
+        indexes = self.active(games)
+        pieces = self.piece[indexes]
+        old_rotation = self.rotation[indexes]
+        new_rotation = (old_rotation + (-1 if rotate_anticlockwise else 1)) % 4
+
+        # Prevent the O shape from wobbling
+        offsets = OFFSETS[pieces, old_rotation, new_rotation]
+        new_x = self.shape_x[indexes] + offsets[:, 0]
+        new_y = self.shape_y[indexes] + offsets[:, 1]
+
+        # Check we didn't rotate off the board - if we did, move it back on
+        left_column = new_x + LEFT_COLUMN[pieces, new_rotation]
+        new_x -= np.minimum(left_column, 0)
+
+        hit = self.check_collision(indexes, new_rotation, new_x, new_y)
+        fits = ~hit
+        indexes = indexes[fits]
+        self.rotation[indexes] = new_rotation[fits]
+        self.shape_x[indexes] = new_x[fits]
+        self.shape_y[indexes] = new_y[fits]
+        rotated[indexes] = True
+        return rotated
+
+    def drop(self, games=None):
+        """
+        Drop the shapes of the games in games (all if None) down one space.
+        Shapes that hit something are locked, lines are cleared and new shapes made.
+        Returns a bool array of which games locked a shape
+        """
+        locked = np.zeros(self.count, dtype=bool)
+        indexes = self.active(games)
+        new_y = self.shape_y[indexes] + 1
+        hit = self.check_collision(indexes, self.rotation[indexes], self.shape_x[indexes], new_y)
+        self.shape_y[indexes[~hit]] = new_y[~hit]
+
+        indexes = indexes[hit]
+        if len(indexes):
+            self.lock(indexes)
+            locked[indexes] = True
+        return locked
+
+    def hard_drop(self, games=None):
+        """ Drop the shapes of the games in games (all if None) until every one has locked """
+        if games is None:
+            games = np.ones(self.count, dtype=bool)
+        falling = games & ~self.game_over
+        while falling.any():
+            falling &= ~self.drop(falling)
+
+    def lock(self, indexes):
+        """ Join the falling shapes of the games in indexes onto their boards """
+        pieces = self.piece[indexes]
+        rotation = self.rotation[indexes]
+        rows = CELL_ROWS[pieces, rotation] + self.shape_y[indexes, None]
+        cols = CELL_COLS[pieces, rotation] + self.shape_x[indexes, None]
+        # Shape numbers are 2 - 8 for colouring, the same as in SHAPES
+        self.boards[indexes[:, None], rows, cols] = (pieces + 2)[:, None]
+        self.pieces[indexes] += 1
+
+        self.clear_lines(indexes)
+
+        games = np.zeros(self.count, dtype=bool)
+        games[indexes] = True
+        self.new_shapes(games)
+
+    def clear_lines(self, indexes):
+        """
+        Removes every full row from the boards in indexes in one go,
+        then updates the score and level like TetrisEngine.lines_cleared
+        """
+        boards = self.boards[indexes, :-1]
+        full = (boards != 0).all(axis=2)
+        lines = full.sum(axis=1)
+        if not lines.any():
+            return
+
+        # Sort each board's rows so full ones go to the top, keeping the order of the rest
+        order = np.argsort(~full, axis=1, kind="stable")
+        boards = np.take_along_axis(boards, order[:, :, None], axis=1)
+        # Then blank the full rows
+        boards[np.arange(ROW_COUNT)[None, :] < lines[:, None]] = 0
+        self.boards[indexes, :-1] = boards
+
+        self.lines[indexes] += lines
+        # Score each line at the level it was cleared on
+        for line in range(lines.max()):
+            scoring = indexes[lines > line]
+            self.score[scoring] += 200 // self.level[scoring]
+            self.level[scoring] += self.score[scoring] >= LEVEL_UP_SCORES[self.level[scoring]]
+
+
+def random_placements(count, rng):
+    """ A random rotation (0 - 3) and column to drop at for each game """
+    return rng.integers(0, 4, count), rng.integers(0, COL_COUNT, count)
+
+
+def run_batch(games, rounds, seed):
+    """
+    Plays every game for rounds pieces using random placements.
+    Games that end are re-started. Returns the number of pieces placed
+    """
+    batch = BatchEngine(games, seed)
+    batch.setup()
+    rng = np.random.default_rng(seed)
+    placed = 0
+    for _round in range(rounds):
+        rotations, columns = random_placements(games, rng)
+        for turn in range(3):
+            batch.rotate(rotations > turn)
+        # Move towards the column one space at a time, like a player would
+        for _step in range(COL_COUNT):
+            batch.move(np.sign(columns - batch.shape_x))
+        batch.hard_drop()
+        if batch.game_over.any():
+            placed += batch.pieces[batch.game_over].sum()
+            batch.setup(batch.game_over.copy())
+    return placed + batch.pieces.sum()
+
+
+def run_scalar(games, rounds, seed):
+    """ The same as run_batch, but one TetrisEngine at a time """
+    rng = random.Random(seed)
+    placed = 0
+    for game in range(games):
+        # Uniform random shapes like BatchEngine, seeded so every run places the same ones
+        engine = TetrisEngine(derive_seed(seed, game), RANDOM)
+        engine.setup()
+        for _round in range(rounds):
+            rotation, column = rng.randrange(4), rng.randrange(COL_COUNT)
+            for _turn in range(rotation):
+                engine.rotate(False)
+            for _step in range(COL_COUNT):
+                if engine.shape_x != column:
+                    engine.move(1 if column > engine.shape_x else -1)
+            while not engine.drop():
+                pass
+            if engine.game_over:
+                placed += engine.pieces
+                engine.setup()
+        placed += engine.pieces
+    return placed
+
+
+def benchmark(games, rounds, seed):
+    """ Prints pieces per second for the batch engine and TetrisEngine """
+    start = time.perf_counter()
+    batch_pieces = run_batch(games, rounds, seed)
+    batch_time = time.perf_counter() - start
+    batch_rate = batch_pieces / batch_time
+    print("BatchEngine:  {} games x {} rounds - {:,.0f} pieces/sec".format(games, rounds, batch_rate))
+
+    # The scalar engine is much slower so run fewer games - the rate is per piece either way
+    scalar_games = max(1, games // 16)
+    start = time.perf_counter()
+    scalar_pieces = run_scalar(scalar_games, rounds, seed)
+    scalar_time = time.perf_counter() - start
+    scalar_rate = scalar_pieces / scalar_time
+    print("TetrisEngine: {} games x {} rounds - {:,.0f} pieces/sec".format(scalar_games, rounds, scalar_rate))
+
+    print("Speed up: {:.1f}x".format(batch_rate / scalar_rate))
+
+
+def main():
+    """ Main Method """
+    parser = argparse.ArgumentParser(description="Benchmark the batch Tetris simulator")
+    parser.add_argument("--games", type=int, default=4096, help="number of games to run at once")
+    parser.add_argument("--rounds", type=int, default=100, help="pieces to place in each game")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    benchmark(args.games, args.rounds, args.seed)
+
+
+if __name__ == "__main__":
+    main()
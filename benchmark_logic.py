@@ -0,0 +1,309 @@
+"""
+Tetris logic benchmarks
+Times the game logic functions against seeded boards, so the numbers are the same
+every run on the same machine. Each benchmark is ran on every board fixture:
+empty, half_full, near_top_out and many_holes.
+
+For each benchmark prints ops/sec and the bytes allocated per op (the peak
+tracemalloc sees while running it, and how much is still held after).
+
+Save a baseline, then run again after a change to flag anything slower:
+python benchmark_logic.py --save
+python benchmark_logic.py
+"""
+import argparse
+import itertools
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+from tetris_logic import (ROW_COUNT, COL_COUNT, SHAPES, ROTATION_TABLE, ROTATION_MASKS, ROTATION_PROFILES,
+                          new_board, check_collision, join_matrixes, remove_row, get_heights, check_collision_bits,
+                          bit_board_from_board, get_landing_y, get_rotated_tile, check_level, TetrisEngine)
+
+BASELINE_FILE = "benchmark_baseline.json"
+
+# How many ops a benchmark is timed for, how many times that is repeated (the fastest is kept)
+# and how many ops are ran under tracemalloc
+OPS = 20000
+REPEATS = 5
+ALLOC_OPS = 200
+
+# How much slower than the baseline (as a fraction) counts as a regression
+THRESHOLD = 0.2
+
+
+# BOARD FIXTURES
+
+def fill_rows(board, rng, first_row, chance):
+    """
+    Fill every row from first_row down to the floor with random blocks, each cell filled with
+    chance. Every row keeps at least one gap so none of them are full lines
+    """
+    for row in range(first_row, ROW_COUNT):
+        for column in range(COL_COUNT):
+            if rng.random() < chance:
+                board[row][column] = rng.randint(2, len(SHAPES) + 1)
+        board[row][rng.randrange(COL_COUNT)] = 0
+    return board
+
+
+def create_fixture(name, seed):
+    """ Make the board for fixture name. The same name and seed always make the same board """
+    rng = random.Random("{}-{}".format(name, seed))
+    board = new_board(ROW_COUNT, COL_COUNT, False)
+    if name == "half_full":
+        fill_rows(board, rng, ROW_COUNT // 2, 0.8)
+    elif name == "near_top_out":
+        # Leave room at the top for a shape to spawn
+        fill_rows(board, rng, 4, 0.8)
+    elif name == "many_holes":
+        fill_rows(board, rng, ROW_COUNT // 3, 0.5)
+    return board
+
+
+FIXTURES = ["empty", "half_full", "near_top_out", "many_holes"]
+
+
+def get_placements(board, rng, count):
+    """
+    Make count random (piece, rotation, x, y) placements that fit on board, where y is
+    the row the shape lands on if it's dropped from the top (like find_drop_y in simulate)
+    """
+    bit_board = bit_board_from_board(board)
+    heights = get_heights(bit_board)
+    placements = []
+    while len(placements) < count:
+        piece = rng.randrange(len(SHAPES))
+        rotation = rng.randrange(4)
+        shape_x = rng.randrange(-2, COL_COUNT)
+        shape_masks = ROTATION_MASKS[piece][rotation]
+        if check_collision_bits(bit_board, shape_masks, (shape_x, 0)):
+            continue
+        shape_y = get_landing_y(bit_board, heights, shape_masks, ROTATION_PROFILES[piece][rotation], (shape_x, 0))
+        placements.append((piece, rotation, shape_x, shape_y))
+    return placements
+
+
+def set_engine_board(engine, board, placement):
+    """ Put board and a falling shape at placement into engine """
+    piece, rotation, shape_x, _shape_y = placement
+    engine.board = board
+    engine.bit_board = bit_board_from_board(board)
+    engine.heights = get_heights(engine.bit_board)
+    engine.piece = piece
+    engine.rotation = rotation
+    engine.shape = ROTATION_TABLE[piece][rotation]
+    engine.shape_masks = ROTATION_MASKS[piece][rotation]
+    engine.shape_x = shape_x
+    engine.shape_y = 0
+    engine.ghost_y = None
+    return engine
+
+
+# BENCHMARKS
+# Each one takes (board, rng) and returns (op, make_args). make_args() is called before timing
+# starts to make the arguments for one call of op, so copying boards isn't timed.
+
+def bench_check_collision(board, rng):
+    """ check_collision with random shapes and places, some colliding and some not """
+    cases = []
+    for _case in range(64):
+        shape = ROTATION_TABLE[rng.randrange(len(SHAPES))][rng.randrange(4)]
+        cases.append((board, shape, (rng.randrange(COL_COUNT - 1), rng.randrange(ROW_COUNT - 2))))
+    cases = itertools.cycle(cases)
+    return check_collision, lambda: next(cases)
+
+
+def bench_join_matrixes(board, rng):
+    """ join_matrixes of a shape where it lands onto a copy of the board """
+    placements = get_placements(board, rng, 64)
+
+    def make_args():
+        piece, rotation, shape_x, shape_y = rng.choice(placements)
+        return [row[:] for row in board], ROTATION_TABLE[piece][rotation], (shape_x, shape_y + 1)
+
+    return join_matrixes, make_args
+
+
+def bench_remove_row(board, rng):
+    """ remove_row of a random row from a copy of the board """
+    return remove_row, lambda: ([row[:] for row in board], rng.randrange(ROW_COUNT))
+
+
+def bench_get_rotated_tile(_board, rng):
+    """ get_rotated_tile of every tile of a random shape around its centre """
+    cases = []
+    for _case in range(64):
+        shape = SHAPES[rng.randrange(len(SHAPES))]
+        center = len(shape[0]) // 2, len(shape) // 2
+        tile = rng.randrange(len(shape[0])), rng.randrange(len(shape))
+        cases.append((tile, center, rng.random() < 0.5))
+    cases = itertools.cycle(cases)
+    return get_rotated_tile, lambda: next(cases)
+
+
+def bench_rotate(board, rng):
+    """
+    Rotating the falling shape at the top of the board (what GameView.rotate_shape does).
+    The shape turns round and round, sometimes blocked by the board
+    """
+    engine = set_engine_board(TetrisEngine(), [row[:] for row in board], get_placements(board, rng, 1)[0])
+    return engine.rotate, lambda: (rng.random() < 0.5,)
+
+
+def bench_drop_clear(board, rng):
+    """
+    Dropping a shape that locks and clears lines (what GameView.drop does when it lands).
+    The shape starts just above where it lands and the rows it lands in are filled up
+    around it, so it clears 1 - 4 lines
+    """
+    placements = get_placements(board, rng, 64)
+
+    def make_args():
+        placement = rng.choice(placements)
+        piece, rotation, shape_x, shape_y = placement
+        new = [row[:] for row in board]
+        for count_y, row in enumerate(ROTATION_TABLE[piece][rotation]):
+            if any(row):
+                for column in range(COL_COUNT):
+                    if not (0 <= column - shape_x < len(row) and row[column - shape_x]):
+                        new[shape_y + count_y][column] = 1
+        engine = TetrisEngine(rng.random())
+        engine.setup()
+        set_engine_board(engine, new, placement)
+        engine.shape_y = shape_y
+        return engine,
+
+    return TetrisEngine.drop, make_args
+
+
+def bench_check_level(_board, rng):
+    """ check_level with random levels and scores """
+    cases = [(rng.randint(1, 7), rng.randrange(3000)) for _case in range(64)]
+    cases = itertools.cycle(cases)
+    return check_level, lambda: next(cases)
+
+
+# name: (function, whether it uses the board fixtures)
+BENCHMARKS = {"check_collision": (bench_check_collision, True),
+              "join_matrixes": (bench_join_matrixes, True),
+              "remove_row": (bench_remove_row, True),
+              "get_rotated_tile": (bench_get_rotated_tile, False),
+              "rotate_shape": (bench_rotate, True),
+              "drop_clear": (bench_drop_clear, True),
+              "check_level": (bench_check_level, False)}
+
+
+# RUNNING
+
+def time_ops(op, make_args, ops, repeats):
+    """
+    Returns how many times a second op ran over ops calls.
+    Timed repeats times and the fastest is kept, as the slower runs are the machine doing something else
+    """
+    best = 0
+    for _repeat in range(repeats):
+        all_args = [make_args() for _op in range(ops)]
+        start = time.perf_counter()
+        for args in all_args:
+            op(*args)
+        best = max(best, ops / (time.perf_counter() - start))
+    return best
+
+
+def measure_allocations(op, make_args, ops):
+    """
+    Returns (peak, held) - the average bytes allocated while running op once,
+    and the average bytes still allocated after it finished
+    """
+    all_args = [make_args() for _op in range(ops)]
+    peak_total = 0
+    held_total = 0
+    for args in all_args:
+        # Restarting tracemalloc resets the peak
+        tracemalloc.start()
+        op(*args)
+        held, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        peak_total += peak
+        held_total += held
+    return peak_total / ops, held_total / ops
+
+
+def run_benchmarks(seed, ops, repeats, names=None):
+    """ Runs the benchmarks (all of them if names is None) and returns {"benchmark/fixture": results} """
+    results = {}
+    for name, (bench, uses_board) in BENCHMARKS.items():
+        if names and name not in names:
+            continue
+        for fixture in FIXTURES if uses_board else ["none"]:
+            board = create_fixture(fixture, seed)
+            # One rng for timing and one for allocations so both see the same ops
+            op, make_args = bench(board, random.Random("{}-{}-{}".format(name, fixture, seed)))
+            ops_per_sec = time_ops(op, make_args, ops, repeats)
+            op, make_args = bench(board, random.Random("{}-{}-{}".format(name, fixture, seed)))
+            peak, held = measure_allocations(op, make_args, min(ops, ALLOC_OPS))
+            results["{}/{}".format(name, fixture)] = {"ops_per_sec": round(ops_per_sec, 1),
+                                                      "peak_bytes_per_op": round(peak, 1),
+                                                      "held_bytes_per_op": round(held, 1)}
+    return results
+
+
+def compare(results, baseline, threshold):
+    """ Returns the names of the benchmarks that are more than threshold slower than the baseline """
+    regressions = []
+    for key, result in results.items():
+        if key in baseline:
+            if result["ops_per_sec"] < baseline[key]["ops_per_sec"] * (1 - threshold):
+                regressions.append(key)
+    return regressions
+
+
+def main():
+    """ Main Method """
+    parser = argparse.ArgumentParser(description="Benchmark the Tetris game logic")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the board fixtures")
+    parser.add_argument("--ops", type=int, default=OPS, help="ops to time each benchmark for")
+    parser.add_argument("--repeats", type=int, default=REPEATS, help="times to repeat the timing, the best is kept")
+    parser.add_argument("--only", nargs="+", choices=list(BENCHMARKS), help="only run these benchmarks")
+    parser.add_argument("--baseline", default=BASELINE_FILE, help="baseline JSON file")
+    parser.add_argument("--save", action="store_true", help="save these results as the baseline")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD,
+                        help="fraction slower than the baseline that counts as a regression (default 0.2)")
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.seed, args.ops, args.repeats, args.only)
+
+    baseline = {}
+    if not args.save and os.path.exists(args.baseline):
+        with open(args.baseline) as file:
+            baseline = json.load(file)["results"]
+
+    print("{:<30} {:>14} {:>10} {:>10} {:>9}".format("benchmark", "ops/sec", "peak B/op", "held B/op", "change"))
+    for key, result in results.items():
+        change = ""
+        if key in baseline:
+            change = "{:+.1%}".format(result["ops_per_sec"] / baseline[key]["ops_per_sec"] - 1)
+        print("{:<30} {:>14,.0f} {:>10.1f} {:>10.1f} {:>9}".format(
+            key, result["ops_per_sec"], result["peak_bytes_per_op"], result["held_bytes_per_op"], change))
+
+    if args.save:
+        with open(args.baseline, "w") as file:
+            json.dump({"seed": args.seed, "python": sys.version.split()[0], "results": results}, file, indent=2)
+        print("Saved baseline to {}".format(args.baseline))
+        return
+
+    regressions = compare(results, baseline, args.threshold)
+    if regressions:
+        print("Slower than the baseline by more than {:.0%}:".format(args.threshold), file=sys.stderr)
+        for key in regressions:
+            print("  " + key, file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
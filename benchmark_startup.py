@@ -0,0 +1,136 @@
+"""
+Tetris startup benchmark
+Times how long the game takes from the process starting to the first frame of the menu
+being shown, split into phases so we know what to speed up:
+
+python          - starting python itself
+import_arcade   - import arcade (and pyglet, PIL and everything they bring in)
+import_game     - import tetris_07 (and tetris_logic)
+window          - making the arcade.Window like main() does
+assets          - loading every menu, game over and sound file into the asset cache
+box_texture     - making the white box texture the board tiles are tinted from
+fonts           - finding the fonts the game draws its text with
+menu_setup      - MenuView.setup
+first_frame     - drawing the menu and flipping it to the screen
+
+Each run is a new process so nothing is already imported or loaded. By default the window
+has no display and uses software OpenGL (ARCADE_HEADLESS and LIBGL_ALWAYS_SOFTWARE), so it
+runs the same on a headless Linux box. Exits with 1 if the median time to the first frame
+is over the budget:
+python benchmark_startup.py --runs 5 --budget 3
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+PHASES = ["python", "import_arcade", "import_game", "window", "assets", "box_texture", "fonts",
+          "menu_setup", "first_frame"]
+
+# Fonts the game draws its text with
+FONTS = ["Neuropol Nova Regular", "Courier New"]
+
+# Seconds from the process starting to the first frame
+BUDGET = 3.0
+
+
+def measure_startup(spawn_time):
+    """
+    Ran in the new process - starts the game up phase by phase like main() does.
+    spawn_time is the time.time() the process was started at.
+    Returns {phase: seconds} and the OpenGL renderer used
+    """
+    times = {"python": time.time() - spawn_time}
+
+    start = time.perf_counter()
+    import arcade
+    import pyglet
+    times["import_arcade"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    import tetris_07
+    times["import_game"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    window = arcade.Window(tetris_07.SCREEN_WIDTH, tetris_07.SCREEN_HEIGHT, tetris_07.TITLE)
+    times["window"] = time.perf_counter() - start
+
+    # main() loads these in the background, here they're loaded straight away so they can be timed
+    start = time.perf_counter()
+    tetris_07.asset_cache.preload(background=False)
+    times["assets"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    tetris_07.create_box_texture()
+    times["box_texture"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for font_name in FONTS:
+        pyglet.font.load(font_name, tetris_07.TITLE_FONT_SIZE)
+    times["fonts"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    start_view = tetris_07.MenuView()
+    window.show_view(start_view)
+    start_view.setup()
+    times["menu_setup"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    start_view.on_draw()
+    window.flip()
+    # Wait for the GPU to really finish the frame
+    window.ctx.finish()
+    times["first_frame"] = time.perf_counter() - start
+
+    times["total"] = time.time() - spawn_time
+    return times, window.ctx.info.RENDERER
+
+
+def run_once(display):
+    """ Starts a new process to measure one startup and returns what it measured """
+    env = dict(os.environ)
+    if not display:
+        env["ARCADE_HEADLESS"] = "1"
+        env["LIBGL_ALWAYS_SOFTWARE"] = "1"
+    spawn_time = time.time()
+    output = subprocess.run([sys.executable, os.path.abspath(__file__), "--child", repr(spawn_time)],
+                            env=env, cwd=os.path.dirname(os.path.abspath(__file__)),
+                            stdout=subprocess.PIPE, check=True, universal_newlines=True).stdout
+    # The results are the last line, anything printed while starting up comes before it
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    """ Main Method """
+    parser = argparse.ArgumentParser(description="Time how long Tetris takes to show its first frame")
+    parser.add_argument("--runs", type=int, default=5, help="number of startups to time, the median is used")
+    parser.add_argument("--budget", type=float, default=BUDGET,
+                        help="seconds allowed to the first frame (default {})".format(BUDGET))
+    parser.add_argument("--display", action="store_true",
+                        help="use the real display and OpenGL driver instead of headless software OpenGL")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        times, renderer = measure_startup(float(args.child))
+        print(json.dumps({"times": times, "renderer": renderer}))
+        return
+
+    runs = [run_once(args.display) for _run in range(args.runs)]
+    print("OpenGL renderer: {}".format(runs[0]["renderer"]))
+    print("{:<16} {:>10} {:>10} {:>10}".format("phase", "median ms", "min ms", "max ms"))
+    for phase in PHASES + ["total"]:
+        times = [run["times"][phase] * 1000 for run in runs]
+        print("{:<16} {:>10.1f} {:>10.1f} {:>10.1f}".format(phase, statistics.median(times), min(times), max(times)))
+
+    total = statistics.median(run["times"]["total"] for run in runs)
+    if total > args.budget:
+        print("First frame took {:.2f}s, over the {:.2f}s budget".format(total, args.budget), file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""
+Tetris replays
+Plays a game recorded by tetris_07 again. Every game played is saved to
+~/.tetris_2021/last_game_replay.json - the seed for the shapes and every key press
+with the logic step it was pressed on, so the game plays out exactly the same.
+With no file given the last game played is replayed.
+
+With no window it runs as fast as it can and prints the result, which is
+useful for bug reports and for timing real games:
+python replay.py
+
+Or watch it in the window at any speed:
+python replay.py --window --speed 4
+
+Add --renderer shader to draw the board with the one draw call shader instead of sprites.
+"""
+import argparse
+import time
+
+from tetris_logic import REPLAY_FILE, load_recording, replay_headless
+
+
+def main():
+    """ Main Method """
+    parser = argparse.ArgumentParser(description="Play a recorded Tetris game again")
+    parser.add_argument("recording", nargs="?", default=REPLAY_FILE,
+                        help="recording JSON file (default the last game played)")
+    parser.add_argument("--window", action="store_true", help="watch the replay in the game window")
+    parser.add_argument("--speed", type=float, default=1, help="speed multiplier for --window (default 1)")
+    # Checked against BOARD_RENDERERS once the window is being used, so tetris_07 isn't imported without it
+    parser.add_argument("--renderer", help="how --window draws the board, one of BOARD_RENDERERS in tetris_07 "
+                                           "(default sprites)")
+    parser.add_argument("--repeat", type=int, default=1, help="times to replay it with no window, for timing")
+    args = parser.parse_args()
+
+    recording = load_recording(args.recording)
+
+    if args.window:
+        # Only load the graphics when they're needed, so replays with no window start quickly
+        import arcade
+        from tetris_07 import SCREEN_WIDTH, SCREEN_HEIGHT, TITLE, SPRITE_BOARD, BOARD_RENDERERS, GameView
+
+        renderer = args.renderer or SPRITE_BOARD
+        if renderer not in BOARD_RENDERERS:
+            parser.error("--renderer must be one of {}".format(", ".join(BOARD_RENDERERS)))
+        window = arcade.Window(SCREEN_WIDTH, SCREEN_HEIGHT, TITLE)
+        game_view = GameView(replay=recording, replay_speed=args.speed, board_renderer=renderer)
+        game_view.mute = True
+        game_view.dark_mode = True
+        game_view.setup()
+        window.show_view(game_view)
+        arcade.run()
+        return
+
+    start = time.perf_counter()
+    for _repeat in range(args.repeat):
+        engine = replay_headless(recording)
+    seconds = time.perf_counter() - start
+    print("seed {} - score {}, lines {}, pieces {}, level {}, {:.1f}s of game time at {} Hz{}".format(
+        recording.seed, engine.score, engine.lines, engine.pieces, engine.level, engine.scheduler.time, recording.logic_hz,
+        " (game over)" if engine.game_over else ""))
+    print("{} replays in {:.2f}s - {:,.0f}x real time".format(
+        args.repeat, seconds, args.repeat * engine.scheduler.time / seconds))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+"""
+Tetris self-play farm
+Plays lots of seeded games with no window, spread over every core
+using a process pool. Each game's result (score, lines, pieces and level)
+is printed as a line of JSON as soon as it finishes.
+
+Policies decide where each shape goes. Use one of the built in ones
+(random, greedy) or your own with --policy my_module:my_function.
+A policy is called with (engine, rng) and returns (rotation num, column).
+
+python simulate.py --games 1000 --policy greedy --seed 42
+"""
+import argparse
+import importlib
+import json
+import os
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from tetris_logic import (ROW_COUNT, COL_COUNT, EMPTY_ROW, FULL_ROW, WALL_BITS, ROTATION_MASKS, ROTATION_PROFILES,
+                          BAG, PIECE_MODES, check_collision_bits, join_bits, get_landing_y, derive_seed,
+                          PieceGenerator, TetrisEngine)
+
+
+# POLICIES
+
+def random_policy(engine, rng):
+    """ Drops each shape at a random rotation and column """
+    return rng.randrange(4), rng.randrange(COL_COUNT)
+
+
+def find_drop_y(engine, rotation, shape_x):
+    """ Finds the y the falling shape dropped from the top at shape_x would lock at, None if it can't fit """
+    shape_masks = ROTATION_MASKS[engine.piece][rotation]
+    if check_collision_bits(engine.bit_board, shape_masks, (shape_x, 0)):
+        return None
+    return get_landing_y(engine.bit_board, engine.heights, shape_masks,
+                         ROTATION_PROFILES[engine.piece][rotation], (shape_x, 0))
+
+
+def rate_board(bit_board):
+    """
+    Scores a bit board for the greedy policy - higher is better.
+    Rewards lines it would clear, and takes off for tall and bumpy columns and holes.
+    Weights from https://codemyroad.wordpress.com/2013/04/14/tetris-ai-the-near-perfect-player/
+    """
+    lines = 0
+    holes = 0
+    heights = [0] * COL_COUNT
+    # Bits of columns that have had a block in them so far, going down from the top
+    # Start with the walls so they don't count as columns
+    covered = EMPTY_ROW
+    for row_num, row in enumerate(bit_board[:-1]):
+        if row == FULL_ROW:
+            lines += 1
+            continue
+        # Empty cells under a block are holes
+        holes += bin(covered & ~row).count("1")
+        new_columns = row & ~covered
+        if new_columns:
+            for column in range(COL_COUNT):
+                if new_columns >> (column + WALL_BITS) & 1:
+                    heights[column] = ROW_COUNT - row_num
+        covered |= row
+
+    bumpiness = sum(abs(heights[column] - heights[column + 1]) for column in range(COL_COUNT - 1))
+    return lines * 0.76 - sum(heights) * 0.51 - holes * 0.36 - bumpiness * 0.18
+
+
+def greedy_policy(engine, rng):
+    """ Tries every rotation and column, then picks the one that leaves the best board """
+    best = None
+    best_rating = None
+    for rotation in range(4):
+        shape_masks = ROTATION_MASKS[engine.piece][rotation]
+        for shape_x in range(-WALL_BITS, COL_COUNT):
+            shape_y = find_drop_y(engine, rotation, shape_x)
+            if shape_y is None:
+                continue
+            bit_board = join_bits(list(engine.bit_board), shape_masks, (shape_x, shape_y + 1))
+            rating = rate_board(bit_board)
+            if best_rating is None or rating > best_rating:
+                best = rotation, shape_x
+                best_rating = rating
+    if best is None:
+        return random_policy(engine, rng)
+    return best
+
+
+POLICIES = {"random": random_policy,
+            "greedy": greedy_policy}
+
+
+def load_policy(name):
+    """ Gets a built in policy by name, or imports one given as module:function """
+    if name in POLICIES:
+        return POLICIES[name]
+    if ":" not in name:
+        raise ValueError("Unknown policy {!r}, use one of {} or module:function".format(name, ", ".join(POLICIES)))
+    module_name, function_name = name.split(":", 1)
+    return getattr(importlib.import_module(module_name), function_name)
+
+
+# PLAYING GAMES
+
+def place_shape(engine, rotation, column):
+    """ Rotate the falling shape, move it to column and hard drop it """
+    for _turn in range(rotation):
+        engine.rotate(False)
+    # Move towards the column until we get there or something is in the way
+    while engine.shape_x != column:
+        if not engine.move(1 if column > engine.shape_x else -1):
+            break
+    engine.hard_drop()
+
+
+def play_game(game, seed, mode, policy_name, max_pieces):
+    """
+    Plays one game with no window until game over or max_pieces have been placed.
+    Ran in the worker processes, returns a dict of the results
+    """
+    policy = load_policy(policy_name)
+    # The policy gets its own stream so it doesn't line up with the shapes
+    rng = random.Random(derive_seed(seed, "policy"))
+    engine = TetrisEngine(seed, mode)
+    engine.setup()
+
+    start = time.perf_counter()
+    while not engine.game_over and engine.pieces < max_pieces:
+        rotation, column = policy(engine, rng)
+        place_shape(engine, rotation, column)
+
+    return {"game": game,
+            "seed": seed,
+            "mode": mode,
+            "score": engine.score,
+            "lines": engine.lines,
+            "pieces": engine.pieces,
+            "level": engine.level,
+            "game_over": engine.game_over,
+            "seconds": round(time.perf_counter() - start, 4)}
+
+
+def simulate(games, seed, mode, policy_name, max_pieces, workers):
+    """
+    Plays games games over workers processes.
+    Each game gets its own piece generator spawned from seed, so no two games share shapes.
+    Yields each game's results as it finishes (not in game order)
+    """
+    generators = PieceGenerator(seed, mode).spawn(games)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(play_game, game, generator.seed, mode, policy_name, max_pieces)
+                   for game, generator in enumerate(generators)]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+def main():
+    """ Main Method """
+    parser = argparse.ArgumentParser(description="Play lots of Tetris games with no window")
+    parser.add_argument("--games", type=int, default=100, help="number of games to play")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="each game's seed is derived from this, it's printed with the game's results")
+    parser.add_argument("--pieces", choices=PIECE_MODES, default=BAG, help="how the shapes are picked (default bag)")
+    parser.add_argument("--policy", default="greedy",
+                        help="random, greedy or module:function (default greedy)")
+    parser.add_argument("--max-pieces", type=int, default=10000, help="stop a game after this many pieces")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="number of processes (default all cores)")
+    args = parser.parse_args()
+
+    # Check the policy loads before starting the workers
+    load_policy(args.policy)
+
+    start = time.perf_counter()
+    total_pieces = 0
+    total_score = 0
+    for result in simulate(args.games, args.seed, args.pieces, args.policy, args.max_pieces, args.workers):
+        print(json.dumps(result), flush=True)
+        total_pieces += result["pieces"]
+        total_score += result["score"]
+
+    seconds = time.perf_counter() - start
+    print("{} games, {} pieces in {:.1f}s - {:,.0f} pieces/sec, average score {:.1f}".format(
+        args.games, total_pieces, seconds, total_pieces / seconds, total_score / max(args.games, 1)),
+        file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
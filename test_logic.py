@@ -0,0 +1,383 @@
+"""
+Tests that the fast game logic in tetris_logic plays the same game as the simple versions
+it replaced, so speeding it up can't quietly change the game.
+
+python -m pytest test_logic.py
+"""
+import random
+
+import pytest
+
+from simulate import greedy_policy
+from tetris_logic import (ROW_COUNT, COL_COUNT, SHAPES, WALL_BITS, ROTATION_TABLE, ROTATION_MASKS, ROTATION_PROFILES,
+                          LOCK_DELAY, BAG, RANDOM, PIECE_MODES, new_board, check_collision, join_matrixes, remove_row,
+                          check_collision_bits, join_bits, clear_lines, bit_board_from_board, get_heights,
+                          join_heights, get_landing_y, calculate_rotation_num, get_tile_coordinates_global, offset_o,
+                          rotate_matrix, Scheduler, PieceGenerator, TetrisEngine, Recording, load_recording,
+                          replay_headless)
+
+SEEDS = range(20)
+
+
+def random_board(rng, full_rows=0):
+    """
+    A board with random blocks filling the bottom part, with a gap in every row.
+    full_rows of them are then filled in completely so they clear
+    """
+    board = new_board(ROW_COUNT, COL_COUNT, False)
+    first_row = rng.randrange(ROW_COUNT)
+    chance = rng.random()
+    for row in range(first_row, ROW_COUNT):
+        for column in range(COL_COUNT):
+            if rng.random() < chance:
+                board[row][column] = rng.randint(2, len(SHAPES) + 1)
+        board[row][rng.randrange(COL_COUNT)] = 0
+    for row in rng.sample(range(ROW_COUNT), full_rows):
+        board[row] = [rng.randint(2, len(SHAPES) + 1) for _column in range(COL_COUNT)]
+    return board
+
+
+def get_tile_columns(shape):
+    """ The columns of the shape that have a tile in them """
+    return [count_x for count_x in range(len(shape[0])) if any(row[count_x] for row in shape)]
+
+
+def get_tile_rows(shape):
+    """ The rows of the shape that have a tile in them """
+    return [count_y for count_y, row in enumerate(shape) if any(row)]
+
+
+def get_offsets(shape):
+    """
+    Every offset check_collision gives the right answer for - list indexes below 0 wrap round
+    instead of colliding, so every tile has to be right of the left edge and below the top.
+    Goes past the walls on the right and the floor, which both collide
+    """
+    columns = get_tile_columns(shape)
+    rows = get_tile_rows(shape)
+    for off_x in range(-columns[0], COL_COUNT + WALL_BITS - columns[-1]):
+        for off_y in range(-rows[0], ROW_COUNT + 3):
+            yield off_x, off_y
+
+
+# TIMERS
+
+def test_scheduler_runs_timers_in_order():
+    scheduler = Scheduler()
+    fired = []
+    scheduler.schedule(2, lambda: fired.append("b"))
+    scheduler.schedule(1, lambda: fired.append("a"))
+    # Due at the same time - they run in the order they were added
+    scheduler.schedule(3, lambda: fired.append("c"))
+    scheduler.schedule(3, lambda: fired.append("d"))
+    cancelled = scheduler.schedule(1.5, lambda: fired.append("cancelled"))
+    scheduler.cancel(cancelled)
+    # Cancelling nothing (eg. no lock timer) does nothing
+    scheduler.cancel(None)
+
+    scheduler.advance(0.5)
+    assert fired == []
+    scheduler.advance_to(2)
+    assert fired == ["a", "b"]
+    scheduler.advance(10)
+    assert fired == ["a", "b", "c", "d"]
+    assert scheduler.time == 12
+
+
+def test_scheduler_times_repeats_from_when_they_were_due():
+    scheduler = Scheduler()
+    fired = []
+
+    def tick():
+        fired.append(scheduler.time)
+        scheduler.schedule(1, tick)
+
+    scheduler.schedule(1, tick)
+    # One big step still fires every tick at the time it was due
+    scheduler.advance_to(3.5)
+    assert fired == [1, 2, 3]
+    assert scheduler.time == 3.5
+
+
+def new_locking_engine():
+    """
+    A game with the first shape pushed over to the left and sitting on a row of blocks
+    in the left half of the board. Gravity first runs at 1 second, so the lock delay starts then
+    """
+    engine = TetrisEngine(0)
+    engine.setup()
+    engine.board[ROW_COUNT - 1] = [2] * (COL_COUNT // 2) + [0] * (COL_COUNT - COL_COUNT // 2)
+    engine.bit_board = bit_board_from_board(engine.board)
+    engine.heights = get_heights(engine.bit_board)
+    while engine.move(-1):
+        pass
+    engine.shape_y = engine.landing_y()
+    return engine
+
+
+def test_shape_locks_after_the_lock_delay():
+    engine = new_locking_engine()
+    # Moving along the stack doesn't put off the lock
+    engine.run_until(1 + LOCK_DELAY / 2)
+    assert engine.move(1)
+    engine.run_until(1 + LOCK_DELAY - 0.01)
+    assert engine.pieces == 0
+    engine.run_until(1 + LOCK_DELAY)
+    assert engine.pieces == 1
+    assert engine.shape_y == 0
+
+
+def test_shape_moved_off_the_stack_gets_a_new_lock_delay():
+    engine = new_locking_engine()
+    engine.run_until(1)
+    # Move it off the edge of the blocks so it can fall again
+    while engine.landing_y() == engine.shape_y:
+        assert engine.move(1)
+    engine.run_until(1 + LOCK_DELAY)
+    assert engine.pieces == 0
+
+    # Gravity moves it down a row at 2 seconds onto the floor, and finds it landed at 3
+    engine.run_until(3 + LOCK_DELAY - 0.01)
+    assert engine.pieces == 0
+    engine.run_until(3 + LOCK_DELAY)
+    assert engine.pieces == 1
+
+
+# PICKING SHAPES
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_bag_deals_every_shape_once_a_bag(seed):
+    generator = PieceGenerator(seed, BAG)
+    # Peeking part way into a bag doesn't change what's handed out
+    peeked = generator.peek(10)
+    pieces = [generator.next() for _piece in range(len(SHAPES) * 50)]
+    assert pieces[:10] == peeked
+    for start in range(0, len(pieces), len(SHAPES)):
+        assert sorted(pieces[start:start + len(SHAPES)]) == list(range(len(SHAPES)))
+
+
+@pytest.mark.parametrize("mode", PIECE_MODES)
+def test_same_seed_same_shapes(mode):
+    generator = PieceGenerator(1234, mode)
+    pieces = [generator.next() for _piece in range(100)]
+    generator = PieceGenerator(1234, mode)
+    assert [generator.next() for _piece in range(100)] == pieces
+    generator = PieceGenerator(1235, mode)
+    assert [generator.next() for _piece in range(100)] != pieces
+
+
+def test_unknown_mode():
+    with pytest.raises(ValueError):
+        PieceGenerator(0, "shuffle")
+
+
+@pytest.mark.parametrize("mode", PIECE_MODES)
+def test_spawn_gives_separate_streams(mode):
+    generator = PieceGenerator(0, mode)
+    spawned = generator.spawn(20)
+    # The same every time
+    assert [child.seed for child in generator.spawn(20)] == [child.seed for child in spawned]
+    assert all(child.mode == mode for child in spawned)
+
+    # No two share a seed or a stream of shapes, with the one they were spawned from
+    # or the generators seed + index would give
+    generators = [generator] + spawned + [PieceGenerator(index, mode) for index in range(1, 21)]
+    assert len({child.seed for child in generators}) == len(generators)
+    streams = [tuple(child.next() for _piece in range(50)) for child in generators]
+    assert len(set(streams)) == len(streams)
+
+
+# COLLISIONS
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_check_collision_bits_matches_check_collision(seed):
+    board = random_board(random.Random(seed))
+    bit_board = bit_board_from_board(board)
+    for piece, rotations in enumerate(ROTATION_TABLE):
+        for rotation, shape in enumerate(rotations):
+            shape_masks = ROTATION_MASKS[piece][rotation]
+            for offset in get_offsets(shape):
+                assert check_collision_bits(bit_board, shape_masks, offset) == \
+                    check_collision(board, shape, offset), (piece, rotation, offset)
+
+
+# ROTATION
+
+def get_tiles(shape, offset):
+    """ The board (x, y) and colour of every tile of a shape at offset """
+    shape_x, shape_y = offset
+    return sorted((count_x + shape_x, count_y + shape_y, tile) for count_y, row in enumerate(shape)
+                  for count_x, tile in enumerate(row) if tile)
+
+
+def old_rotate(board, shape, rotation, offset, rotate_anticlockwise):
+    """
+    Rotate a shape like GameView.rotate_shape did before ROTATION_TABLE - rotating each tile
+    around the center, moving the O block so it doesn't wobble, nudging it back off the left
+    wall and rotating back if it collides. Returns the shape, rotation and offset after.
+    The old one kept checking the other tiles after rotating back off the wall, which could
+    move the shape right without rotating it, here it stops like TetrisEngine.rotate does
+    """
+    shape_x, shape_y = offset
+    old_rotation = rotation
+    rotation = calculate_rotation_num(rotate_anticlockwise, rotation)
+    shape_type = shape[1][1]
+    shape = rotate_matrix(shape, rotate_anticlockwise)
+
+    if shape_type == 7:
+        shape_x_offset, shape_y_offset = offset_o(old_rotation, rotation)
+        shape_x += shape_x_offset
+        shape_y += shape_y_offset
+
+    for count_y, row in enumerate(shape):
+        for count_x, tile in enumerate(row):
+            if tile and get_tile_coordinates_global((count_x, count_y), (shape_x, shape_y))[0] < 0:
+                shape_x += 1
+                if check_collision(board, shape, (shape_x, shape_y)):
+                    return old_rotate(board, shape, rotation, (shape_x - 1, shape_y), not rotate_anticlockwise)
+
+    if check_collision(board, shape, (shape_x, shape_y)):
+        return old_rotate(board, shape, rotation, (shape_x, shape_y), not rotate_anticlockwise)
+    return shape, rotation, (shape_x, shape_y)
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_rotate_matches_rotating_each_tile(seed):
+    board = random_board(random.Random(seed))
+    engine = TetrisEngine(seed)
+    engine.setup()
+    engine.board = board
+    engine.bit_board = bit_board_from_board(board)
+    for piece, rotations in enumerate(ROTATION_TABLE):
+        for rotation, shape in enumerate(rotations):
+            for offset in get_offsets(shape):
+                # Only where the shape could be in a game - on the board and not in a block
+                if check_collision(board, shape, offset) or min(get_tiles(shape, offset))[0] < 0:
+                    continue
+                for rotate_anticlockwise in [False, True]:
+                    engine.piece = piece
+                    engine.rotation = rotation
+                    engine.shape = shape
+                    engine.shape_masks = ROTATION_MASKS[piece][rotation]
+                    engine.shape_x, engine.shape_y = offset
+                    engine.rotate(rotate_anticlockwise)
+
+                    old_shape, old_rotation, old_offset = old_rotate(board, shape, rotation, offset,
+                                                                     rotate_anticlockwise)
+                    assert engine.rotation == old_rotation, (piece, rotation, offset, rotate_anticlockwise)
+                    assert get_tiles(engine.shape, (engine.shape_x, engine.shape_y)) == \
+                        get_tiles(old_shape, old_offset), (piece, rotation, offset, rotate_anticlockwise)
+
+
+# LANDING
+
+def old_drop_y(board, shape, offset):
+    """ Where a shape lands moving down one row at a time, like drop did before the column heights """
+    shape_x, shape_y = offset
+    while not check_collision(board, shape, (shape_x, shape_y + 1)):
+        shape_y += 1
+    return shape_y
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_landing_and_join_match_moving_down(seed):
+    board = random_board(random.Random(seed))
+    bit_board = bit_board_from_board(board)
+    heights = get_heights(bit_board)
+    for piece, rotations in enumerate(ROTATION_TABLE):
+        for rotation, shape in enumerate(rotations):
+            shape_masks = ROTATION_MASKS[piece][rotation]
+            for shape_x in range(-WALL_BITS, COL_COUNT):
+                if check_collision_bits(bit_board, shape_masks, (shape_x, 0)):
+                    continue
+                landing_y = get_landing_y(bit_board, heights, shape_masks, ROTATION_PROFILES[piece][rotation],
+                                          (shape_x, 0))
+                assert landing_y == old_drop_y(board, shape, (shape_x, 0)), (piece, rotation, shape_x)
+
+                # Locking it there gives the same board either way
+                joined = join_matrixes([row[:] for row in board], shape, (shape_x, landing_y + 1))
+                joined_bits = join_bits(list(bit_board), shape_masks, (shape_x, landing_y + 1))
+                assert joined_bits == bit_board_from_board(joined)
+                joined_heights = join_heights(list(heights), ROTATION_PROFILES[piece][rotation],
+                                              (shape_x, landing_y + 1))
+                assert joined_heights == get_heights(joined_bits), (piece, rotation, shape_x)
+
+
+# CLEARING LINES
+
+def old_clear_lines(board):
+    """ Clear full lines with remove_row one at a time, starting again after each one, like drop used to """
+    lines = 0
+    while True:
+        for row_num, row in enumerate(board[:-1]):
+            if all(row):
+                board = remove_row(board, row_num)
+                lines += 1
+                break
+        else:
+            return board, lines
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_clear_lines_matches_remove_row(seed):
+    rng = random.Random(seed)
+    board = random_board(rng, full_rows=rng.randint(0, 4))
+    bit_board = bit_board_from_board(board)
+    expected, expected_lines = old_clear_lines([row[:] for row in board])
+
+    lines = clear_lines(board, bit_board)
+    assert lines == expected_lines
+    assert board == expected
+    assert bit_board == bit_board_from_board(expected)
+
+
+# RECORDING AND REPLAYS
+
+def play_recorded_game(seed, mode, logic_hz=60):
+    """
+    Play a game like GameView does with a player - actions at uneven steps, placing each shape
+    where the greedy policy wants it, sometimes dropping it and sometimes leaving gravity
+    and the lock delay to do it. Returns the engine at the end and the recording of it
+    """
+    rng = random.Random(seed)
+    recording = Recording(seed, mode, logic_hz)
+    engine = TetrisEngine(seed, mode)
+    engine.setup()
+    step = 0
+
+    def do(action):
+        recording.add(step, action)
+        engine.do_action(action)
+
+    while not engine.game_over and engine.pieces < 150:
+        pieces = engine.pieces
+        rotation, column = greedy_policy(engine, rng)
+        actions = ["rotate_clockwise"] * rotation
+        actions += ["right" if column > engine.shape_x else "left"] * abs(column - engine.shape_x)
+        actions.append(rng.choice(["hard_drop", "soft_drop", None]))
+        for action in actions:
+            step += rng.randrange(0, 6)
+            engine.run_until(step / logic_hz)
+            if engine.game_over or engine.pieces != pieces:
+                break
+            if action:
+                do(action)
+        # Let gravity finish it off
+        while not engine.game_over and engine.pieces == pieces:
+            step += 1
+            engine.run_until(step / logic_hz)
+    recording.steps = step
+    return engine, recording
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("mode", [BAG, RANDOM])
+def test_recording_replays_the_same(tmp_path, seed, mode):
+    engine, recording = play_recorded_game(seed, mode)
+    path = str(tmp_path / "replay.json")
+    recording.save(path)
+
+    replayed = replay_headless(load_recording(path))
+    assert (replayed.score, replayed.lines, replayed.pieces, replayed.level, replayed.game_over) == \
+        (engine.score, engine.lines, engine.pieces, engine.level, engine.game_over)
+    assert replayed.board == engine.board
@@ -25,16 +25,20 @@ All rights of this soundtrack go to the creator "Sega".
 Music obtained legally through a subscription to Epidemic sound
 - https://www.epidemicsound.com/
 """
+import argparse
 import arcade
+import pyglet
 import random
 import PIL
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+
+from tetris_logic import (ROW_COUNT, COL_COUNT, LOGIC_HZ, REPLAY_FILE, new_board, Scheduler, TetrisEngine,
+                          Recording)
 
-# Define basic sizes
-# No. rows and columns
-ROW_COUNT = 22
-COL_COUNT = 10
 
+# Define basic sizes
 # Width and height of each cell
 WIDTH = 30
 HEIGHT = 30
@@ -57,9 +61,53 @@ SCORE_NUM_TEXT_XY = (SCREEN_WIDTH - 180, SCREEN_HEIGHT - 230)
 
 TITLE_FONT_SIZE = 25
 
+# Top of the controls text, under the next shape box
+CONTROLS_TEXT_Y = 330
+
 NEXT_SHAPE_X = 427
 NEXT_SHAPE_Y = 455
 
+# How see through the ghost shape is (0 - 255)
+GHOST_ALPHA = 60
+
+# How the board is drawn - SPRITE_BOARD is a sprite for every cell, SHADER_BOARD draws the
+# whole board in one pass of a shader from a small texture of the cell values
+SPRITE_BOARD = "sprites"
+SHADER_BOARD = "shader"
+BOARD_RENDERERS = [SPRITE_BOARD, SHADER_BOARD]
+
+# Key to show the frame timings, how many frames of timings to keep
+# and how often the numbers on it are updated (nanoseconds)
+PERF_OVERLAY_KEY = arcade.key.F3
+PERF_BUFFER_SIZE = 300
+PERF_TEXT_INTERVAL = 250_000_000
+
+# The player's actions for each key - these are what is recorded for replays
+KEY_ACTIONS = {arcade.key.DOWN: "soft_drop",
+               arcade.key.SPACE: "hard_drop",
+               arcade.key.LEFT: "left",
+               arcade.key.RIGHT: "right",
+               arcade.key.Z: "rotate_anticlockwise",
+               arcade.key.X: "rotate_clockwise"}
+
+# Keys that repeat while they're held, seconds held before they start repeating and between repeats
+REPEAT_KEYS = [arcade.key.LEFT, arcade.key.RIGHT, arcade.key.DOWN]
+KEY_REPEAT_DELAY = 0.17
+KEY_REPEAT_INTERVAL = 0.05
+
+# Images for the menu and game over screens - packed into one texture atlas
+MENU_BACKGROUND = "resources/menu_view/menu.png"
+START_BUTTON = "resources/menu_view/buttons/start_button_1.png"
+DARK_BUTTON = "resources/menu_view/buttons/dark_button_1.png"
+MUTE_BUTTON = "resources/menu_view/buttons/mute_button_1.png"
+GAME_OVER_BACKGROUND = "resources/game_over_view/game_over.png"
+UI_TEXTURES = [MENU_BACKGROUND, START_BUTTON, DARK_BUTTON, MUTE_BUTTON, GAME_OVER_BACKGROUND]
+UI_ATLAS_SIZE = (2048, 2048)
+
+# Sound effects
+CLEAR_SOUND = "resources/my_sounds/ruler_swoop.mp3"
+SOUNDS = [CLEAR_SOUND]
+
 MUSIC_LIST = ["resources/my_sounds/background_mixes/ES_Candy - Caponium.mp3",
               "resources/my_sounds/background_mixes/ES_Pixel - Josef Falkenskold.mp3",
               "resources/my_sounds/background_mixes/ES_High Score - Eight Bits.mp3",
@@ -77,242 +125,84 @@ COLORS = [(0, 0, 0),  # black - empty squares
           (255, 234, 0),  # Middle Yellow - I block
           ]
 
-# List containing the different tetrominoes - different numbers for colouring purposes
-# it is done so we know our center piece is always at for shape in shapes -> shape[1][2]
-SHAPES = [[[0, 2, 0],
-           [2, 2, 2]],
-
-          [[0, 0, 3],
-           [3, 3, 3]],
-
-          [[4, 0, 0],
-           [4, 4, 4]],
-
-          [[0, 5, 5],
-           [5, 5, 0]],
-
-          [[6, 6, 0],
-           [0, 6, 6]],
-
-          [[0, 7, 7],
-           [0, 7, 7]],
-
-          [[0, 0, 0, 0],
-           [8, 8, 8, 8]]
-          ]
-
-O_OFFSET_DATA = [[0, 0], [0, 1], [-1, 1], [-1, 0]]
-
-
-def create_textures():
-    """ Creates a list of color boxes using width + height and color list called"""
-    new_textures = []
-    # loop through the color list creating a image the size of our pixel for each color
-    # Uses this image to create an arcade texture and add it to the list
-    for color in COLORS:
-        # Create a box
-        # noinspection PyUnresolvedReferences
-        image = PIL.Image.new('RGB', (WIDTH, HEIGHT), color)
-        new_textures.append(arcade.Texture(str(color), image=image))
-    return new_textures
-
-
-texture_list = create_textures()
-
-
-def new_board(row_count, col_count, is_next):
-    """ Create a grid that is X cols by Y rows filled with 0's. """
-    # Board has 0's equal to the num of columns and num of rows.
-    board = [[0 for _x in range(col_count)] for _y in range(row_count)]
-    if not is_next:
-        # Add 1's on the bottom for easier collision checking
-        board += [[1 for _x in range(col_count)]]
-    # Returns a 2d list of 0's that is full of items col_count in length
-    return board
+# If a frame takes so long that more than MAX_CATCH_UP_TIME seconds of logic steps are owed, the rest
+# are dropped so the game slows down for a moment instead of freezing to catch up. It's in seconds
+# so the limit is the same at any logic rate
+MAX_CATCH_UP_TIME = 0.25
 
 
-def check_collision(board, shape, offset):
+def create_box_texture():
     """
-    See if the matrix stored in variable shape will intercept with anything
-    on the board based on the offset. Offset is an (x, y).
+    Creates one white box the size of a cell. Every tile sprite shares it and is
+    tinted to its color from COLORS with sprite.color, so there's one texture whatever the palette size
     """
-    off_x, off_y = offset
-
-    # Enumerate - "for  count, value  in enumerate(values):"
-    # for each row in shape
-    for count_y, row in enumerate(shape):
-        # for each cell in that row
-        for count_x, cell in enumerate(row):
-            # Try / except to stop IndexError for error control
-            try:
-                # if the cell and the board's (x,y) is not a 0, return True (as it must intersect)
-                if cell and board[count_y + off_y][count_x + off_x]:
-                    return True
-            except IndexError:
-                return True
-    return False
-
-
-def join_matrixes(matrix_1, matrix_2, matrix_2_offset):
-    """
-    :param matrix_1: first matrix - the board
-    :param matrix_2: second matrix - the shape
-    :param matrix_2_offset: the offset of the second matrix - the x and y coordinate of shape (x,y)
-    :return: Returns a new matrix containing both matrix - a new board
-    """
-    offset_x, offset_y = matrix_2_offset
-    for count_y, row in enumerate(matrix_2):
-        for count_x, value in enumerate(row):
-            if value:
-                matrix_1[count_y + offset_y - 1][count_x + offset_x] += value
-    return matrix_1
-
-
-def remove_row(board, row):
-    """ Remove a row from the board, add a blank row on top. """
-    del board[row]
-    return [[0 for _ in range(COL_COUNT)]] + board
-
-
-def check_level(level, score):
-    """
-    Checks current level and sees if we need to
-    increase level based on score
-    """
-    if level == 1:
-        if score > 99:
-            level = 2
-    elif level == 2:
-        if score > 299:
-            level = 3
-    elif level == 3:
-        if score > 499:
-            level = 4
-    elif level == 4:
-        if score > 799:
-            level = 5
-    elif level == 5:
-        if score > 799:
-            level = 6
-    elif level == 6:
-        if score > 2000:
-            level = 7
-
-    return level
-
-
-# ROTATION CALCULATION FUNCTIONS
-
-def calculate_rotation_num(rotate_anticlockwise, rotation_num):
-    """
-    A simple loop between 0 - 3 that calculates a new rotation
-    number based on a boolean of anti-clockwise
-    """
-
-    # Calculate new rotation index
-    new_rotation = rotation_num
-    if not rotate_anticlockwise:
-        new_rotation += 1
-    else:
-        new_rotation -= 1
-
-    # Do we need to loop?
-    if new_rotation < 0:
-        new_rotation = 3
-    elif new_rotation > 3:
-        new_rotation = 0
+    # noinspection PyUnresolvedReferences
+    image = PIL.Image.new('RGBA', (WIDTH, HEIGHT), (255, 255, 255, 255))
+    return arcade.Texture("box", image=image)
 
-    return new_rotation
 
-
-def get_tile_coordinates_global(tile_count_xy, shape_xy):
+class AssetCache:
     """
-    Returns a x,y of each tile's global location on the grid
+    Every texture and sound the game uses, loaded once and shared by every view for as long as
+    the game is open, so restarting or reaching game over doesn't read them from disk again.
+    The UI textures are packed into one texture atlas so the menu and game over screens draw from it
     """
-    # Unpack given variables
-    shape_x, shape_y = shape_xy
-    count_x, count_y = tile_count_xy
-    # Do maths to find each tile's x and y relative to the top right hand corner of the matrix
-    tile_pos_x = shape_x + count_x
-    tile_pos_y = (shape_y - 1) + count_y
-    return tile_pos_x, tile_pos_y
-
-
-def get_rotated_tile(tile_coordinates, center_tile_coordinates, clockwise):
-    """
-    Find the rotated coordinates of a tile relative to the top left hand corner
-    Takes center tile coordinates that it will rotate all other blocks around.
-    Works by finding the relative x, y postions or vectors to the center tile and then
-    them through a rotation matrix (based on which way we want to rotate) and then
-    putting them back in to their correct place relative the top LH corner.
-    """
-    tile_x, tile_y = tile_coordinates
-    center_tile_x, center_tile_y = center_tile_coordinates
-
-    # Find the relative position (vector) of a tile to the center tile (origin)
-    relative_position_x = tile_x - center_tile_x
-    relative_position_y = tile_y - center_tile_y
 
-    # Rotation matrix depending on which way we flip
-    if clockwise:
-        rotation_matrix = [[0, 1],
-                           [-1, 0]]
-    else:
-        rotation_matrix = [[0, -1],
-                           [1, 0]]
-
-    # R x Vr = Vnew // Uses a rotation matrix to find the new x and y positions of our tiles
-    new_postion_x = (rotation_matrix[0][0] * relative_position_x) + (rotation_matrix[0][1] * relative_position_y)
-    new_postion_y = (rotation_matrix[1][0] * relative_position_x) + (rotation_matrix[0][0] * relative_position_y)
-
-    # Put it back into it's correct place on the grid
-    new_postion_x += center_tile_x
-    new_postion_y += center_tile_y
-
-    new_position = new_postion_x, new_postion_y
-    return new_position
-
-
-def minus_xy_array(array_a, array_b):
-    """
-    Function for array A - array B (coordinates).
-    Used mostly for offset calculations.
-    Will return a [x, y] list
-    """
-    a_x_value, a_y_value = array_a[0], array_a[1]
-    b_x_value, b_y_value = array_b[0], array_b[1]
-
-    new_x_value = a_x_value - b_x_value
-    new_y_value = a_y_value - b_y_value
-
-    return new_x_value, new_y_value
-
-
-def locateLargest(matrix):
-    """ Finds the longest length row in matrix and returns it. """
-    largest_num = None
-    list = []
-    for count_y, row in enumerate(matrix):
-        potential_num = 0
-
-        for count_x, num in enumerate(row):
-            if num:
-                potential_num += 1
-        list.append(potential_num)
-    largest_num = max(list)
-    return largest_num
+    def __init__(self):
+        self.textures = {}
+        self.sounds = {}
+        # Only one thread loads at a time, so the preload thread and the game never load the same file twice
+        self.lock = threading.Lock()
+        self.preload_thread = None
+        self.ui_atlas = None
+        self.box = None
+
+    def texture(self, path):
+        """ Returns the texture from path, loading it the first time """
+        with self.lock:
+            if path not in self.textures:
+                self.textures[path] = arcade.load_texture(path)
+            return self.textures[path]
+
+    def sound(self, path):
+        """ Returns the sound from path, loading it the first time """
+        with self.lock:
+            if path not in self.sounds:
+                self.sounds[path] = arcade.load_sound(path)
+            return self.sounds[path]
+
+    def preload(self, background=True):
+        """
+        Load every texture and sound. In a background thread if background is True - anything
+        asked for before the thread gets to it is loaded straight away instead
+        """
+        if background:
+            self.preload_thread = threading.Thread(target=self.preload, args=(False,), daemon=True)
+            self.preload_thread.start()
+            return
+        for path in UI_TEXTURES:
+            self.texture(path)
+        for path in SOUNDS:
+            self.sound(path)
+
+    def ui_sprite_list(self):
+        """
+        Returns a new sprite list that draws from the UI texture atlas. The atlas is made the first
+        time (it needs the window, so not from the preload thread)
+        """
+        if self.ui_atlas is None:
+            self.ui_atlas = arcade.TextureAtlas(UI_ATLAS_SIZE, textures=[self.texture(path) for path in UI_TEXTURES])
+        return arcade.SpriteList(atlas=self.ui_atlas)
 
+    def box_texture(self):
+        """ Returns the white box texture for the tiles, made the first time a game is set up """
+        if self.box is None:
+            self.box = create_box_texture()
+        return self.box
 
-def offset_o(old_rotation, new_rotation):
-    """
-    Function to work out the offset of the O block
-    based on old and new rotations. Returns an (x, y) offset.
-    """
-    pos_old = O_OFFSET_DATA[old_rotation]
-    pos_new = O_OFFSET_DATA[new_rotation]
 
-    offset = minus_xy_array(pos_old, pos_new)
-    return offset
+# The one asset cache for the whole game
+asset_cache = AssetCache()
 
 
 class MenuView(arcade.View):
@@ -322,13 +212,18 @@ class MenuView(arcade.View):
 
         self.mute = False
         self.dark_mode = True
+        # How many times a second the game logic runs and how the board is drawn, set from the command line
+        self.logic_hz = LOGIC_HZ
+        self.board_renderer = SPRITE_BOARD
 
-        self.background_texture = "resources/menu_view/menu.png"
-        self.start_button_texture = "resources/menu_view/buttons/start_button_1.png"
-        self.dark_button_texture = "resources/menu_view/buttons/dark_button_1.png"
-        self.mute_button_texture = "resources/menu_view/buttons/mute_button_1.png"
+        self.background_texture = MENU_BACKGROUND
+        self.start_button_texture = START_BUTTON
+        self.dark_button_texture = DARK_BUTTON
+        self.mute_button_texture = MUTE_BUTTON
 
         self.background = None
+        self.background_sprites = None
+        self.under_background_sprites = None
         self.start_button = None
         self.button = None
         self.button_sprites = None
@@ -346,31 +241,34 @@ class MenuView(arcade.View):
         self.color_green = 24, 255, 0
         self.color_dark_green = 255, 0, 32
 
-        self.button_sprites = arcade.SpriteList()
-        self.indicator_sprites = arcade.SpriteList()
+        # Every sprite list draws from the UI atlas
+        self.button_sprites = asset_cache.ui_sprite_list()
+        self.indicator_sprites = asset_cache.ui_sprite_list()
+        self.background_sprites = asset_cache.ui_sprite_list()
 
         # Menu background
-        self.background = arcade.Sprite(self.background_texture, 1)
+        self.background = arcade.Sprite(texture=asset_cache.texture(self.background_texture), scale=1)
         self.background.center_x = SCREEN_WIDTH / 2
         self.background.bottom = 0
         self.background.properties = "background"
+        self.background_sprites.append(self.background)
 
         # Start button
-        self.start_button = arcade.Sprite(self.start_button_texture, 0.5)
+        self.start_button = arcade.Sprite(texture=asset_cache.texture(self.start_button_texture), scale=0.5)
         self.start_button.center_x = SCREEN_WIDTH / 2
         self.start_button.center_y = SCREEN_HEIGHT / 2 + 75
         self.start_button.properties = "start_button"
         self.button_sprites.append(self.start_button)
 
         # Light or dark color mode button
-        self.button = arcade.Sprite(self.dark_button_texture, 0.5)
+        self.button = arcade.Sprite(texture=asset_cache.texture(self.dark_button_texture), scale=0.5)
         self.button.center_x = SCREEN_WIDTH / 2
         self.button.center_y = SCREEN_HEIGHT / 2 - 25
         self.button.properties = "color_button"
         self.button_sprites.append(self.button)
 
         # Mute button
-        self.button = arcade.Sprite(self.mute_button_texture, 0.5)
+        self.button = arcade.Sprite(texture=asset_cache.texture(self.mute_button_texture), scale=0.5)
         self.button.center_x = SCREEN_WIDTH / 2
         self.button.center_y = SCREEN_HEIGHT / 2 - 100
         self.button.properties = "mute_button"
@@ -389,24 +287,30 @@ class MenuView(arcade.View):
         self.mute_button_indicator.properties = "mute_indicator"
         self.indicator_sprites.append(self.mute_button_indicator)
 
+        # The color indicator is drawn under the background and the mute indicator over it
+        self.under_background_sprites = asset_cache.ui_sprite_list()
+        self.under_background_sprites.extend(self.button_sprites)
+        self.under_background_sprites.append(self.color_button_indicator)
+        self.background_sprites.append(self.mute_button_indicator)
+
     def on_draw(self):
         """ Draw this view """
         arcade.start_render()
 
         # Set background and color scheme
         arcade.set_background_color(arcade.color.LIGHT_STEEL_BLUE)
-        self.button_sprites.draw()
 
-        # Check if dark mode is enabled, then draw indicator box
+        # Check if dark mode is enabled, then show indicator box
+        self.color_button_indicator.visible = self.dark_mode
         if self.dark_mode:
-            self.indicator_sprites[0].draw()
             arcade.set_background_color((47, 64, 77))
 
-        self.background.draw()
+        # Check if mute is enabled, then show indicator box
+        self.mute_button_indicator.visible = self.mute
 
-        # Check if mute is enabled, then draw indicator box
-        if self.mute:
-            self.indicator_sprites[1].draw()
+        # Buttons and color indicator, then the background and mute indicator over them
+        self.under_background_sprites.draw()
+        self.background_sprites.draw()
 
     def on_update(self, delta_time: float):
         """ Called every frame """
@@ -433,7 +337,7 @@ class MenuView(arcade.View):
 
             # Start Button
             elif sprite.properties == "start_button":
-                game_view = GameView()
+                game_view = GameView(logic_hz=self.logic_hz, board_renderer=self.board_renderer)
                 game_view.mute = self.mute
                 game_view.dark_mode = self.dark_mode
                 game_view.setup()
@@ -445,18 +349,26 @@ class GameOverView(arcade.View):
         """ This is run once when we switch to this view """
         super().__init__()
 
-        # Load menu texture
-        self.texture = arcade.load_texture("resources/game_over_view/game_over.png")
+        # Menu texture from the asset cache, sized to fill the window
+        self.texture = asset_cache.texture(GAME_OVER_BACKGROUND)
+        self.background_sprites = asset_cache.ui_sprite_list()
+        background = arcade.Sprite(texture=self.texture, center_x=SCREEN_WIDTH / 2, center_y=SCREEN_HEIGHT / 2)
+        background.width = SCREEN_WIDTH
+        background.height = SCREEN_HEIGHT
+        self.background_sprites.append(background)
         self.mute = bool
         self.score = 0
+        # Settings of the game that ended, so the next game is played the same way
+        self.dark_mode = True
+        self.logic_hz = LOGIC_HZ
+        self.board_renderer = SPRITE_BOARD
 
     def on_draw(self):
         """ Draw this view """
         arcade.start_render()
 
         # Display menu texture
-        self.texture.draw_sized(SCREEN_WIDTH / 2, SCREEN_HEIGHT / 2,
-                                SCREEN_WIDTH, SCREEN_HEIGHT)
+        self.background_sprites.draw()
         arcade.draw_text("SCORE:",
                          SCREEN_WIDTH / 2 - 105, SCREEN_HEIGHT - 170,
                          (247, 147, 30), TITLE_FONT_SIZE + 15, font_name="Neuropol Nova Regular")
@@ -466,87 +378,356 @@ class GameOverView(arcade.View):
 
     def on_mouse_press(self, _x, _y, _button, _modifiers):
         """ If the user presses the mouse button, re-start the game. """
-        game_view = GameView()
+        game_view = GameView(logic_hz=self.logic_hz, board_renderer=self.board_renderer)
         game_view.mute = self.mute
+        game_view.dark_mode = self.dark_mode
         game_view.setup()
         self.window.show_view(game_view)
 
 
+# Shaders for BoardRenderer. The quad covers the board, v_pos is how far right of and down from the
+# top left of the first cell each pixel is. Pixels in the margins are discarded so the background shows
+BOARD_VERTEX_SHADER = """
+#version 330
+
+uniform Projection {
+    uniform mat4 matrix;
+} proj;
+uniform vec2 origin;
+
+in vec2 in_vert;
+out vec2 v_pos;
+
+void main() {
+    gl_Position = proj.matrix * vec4(in_vert, 0.0, 1.0);
+    v_pos = vec2(in_vert.x - origin.x, origin.y - in_vert.y);
+}
+"""
+
+BOARD_FRAGMENT_SHADER = """
+#version 330
+
+uniform sampler2D cells;
+uniform sampler2D palette;
+uniform vec2 cell_size;
+uniform vec2 cell_step;
+
+in vec2 v_pos;
+out vec4 f_color;
+
+void main() {
+    vec2 cell = floor(v_pos / cell_step);
+    vec2 inside = v_pos - cell * cell_step;
+    if (inside.x >= cell_size.x || inside.y >= cell_size.y) {
+        discard;
+    }
+    int value = int(texelFetch(cells, ivec2(cell), 0).r * 255.0 + 0.5);
+    f_color = vec4(texelFetch(palette, ivec2(value, 0), 0).rgb, 1.0);
+}
+"""
+
+
+class BoardRenderer:
+    """
+    Draws the board in one draw call. The board's cell values are kept in a texture one texel
+    per cell, and the shader looks each one up in a palette texture of COLORS, working out the
+    margins from the pixel's position. Only the texels of cells that changed are written
+    """
+
+    def __init__(self, ctx, row_count, col_count):
+        self.ctx = ctx
+        self.row_count = row_count
+        self.col_count = col_count
+        self.program = ctx.program(vertex_shader=BOARD_VERTEX_SHADER, fragment_shader=BOARD_FRAGMENT_SHADER)
+
+        # Top left of the first cell - the same place the sprite board puts it
+        origin_x = MARGIN
+        origin_y = SCREEN_HEIGHT + MARGIN + HEIGHT
+        self.program["origin"] = origin_x, origin_y
+        self.program["cell_size"] = WIDTH, HEIGHT
+        self.program["cell_step"] = WIDTH + MARGIN, HEIGHT + MARGIN
+        self.program["cells"] = 0
+        self.program["palette"] = 1
+
+        # One quad over every cell and the margins after them
+        size = (WIDTH + MARGIN) * col_count, (HEIGHT + MARGIN) * row_count
+        self.geometry = arcade.gl.geometry.quad_2d(size=size, pos=(origin_x + size[0] / 2, origin_y - size[1] / 2))
+
+        # Cell values, one byte each. Row 0 of the texture is the top row of the board
+        self.cells = ctx.texture((col_count, row_count), components=1, dtype="f1",
+                                 filter=(ctx.NEAREST, ctx.NEAREST))
+        self.palette = ctx.texture((len(COLORS), 1), components=4,
+                                   data=bytes(value for color in COLORS for value in (*color, 255)),
+                                   filter=(ctx.NEAREST, ctx.NEAREST))
+
+    def update(self, board, dirty_rows, dirty_cells):
+        """ Write the changed cells of board into the cell texture - the same dirty rows and cells as get_dirty """
+        # Whole rows that changed in one write
+        if dirty_rows:
+            self.cells.write(bytes(value for row in board[:dirty_rows] for value in row),
+                             viewport=(0, 0, self.col_count, dirty_rows))
+        # Single cells that changed below them
+        for row, column in dirty_cells:
+            if row >= dirty_rows:
+                self.cells.write(bytes((board[row][column],)), viewport=(column, row, 1, 1))
+
+    def draw(self):
+        """ Draw the whole board """
+        self.cells.use(0)
+        self.palette.use(1)
+        self.geometry.render(self.program)
+
+
+class RingBuffer:
+    """ Fixed size buffer of the last size numbers added - the oldest is written over when it's full """
+
+    def __init__(self, size):
+        self.values = [0] * size
+        self.index = 0
+        self.count = 0
+
+    def add(self, value):
+        """ Add a value, writing over the oldest one if the buffer is full """
+        self.values[self.index] = value
+        self.index = (self.index + 1) % len(self.values)
+        if self.count < len(self.values):
+            self.count += 1
+
+    def percentile(self, percent):
+        """ Return the value percent% of the buffer is less than or equal to, 0 if it's empty """
+        if not self.count:
+            return 0
+        values = sorted(self.values[:self.count])
+        return values[min(self.count - 1, self.count * percent // 100)]
+
+    def mean(self):
+        """ Return the average of the values in the buffer, 0 if it's empty """
+        if not self.count:
+            return 0
+        return sum(self.values[:self.count]) / self.count
+
+
+class PerfOverlay:
+    """
+    Collects frame times and how long each phase of the game takes, and draws them over the game.
+    Toggle with PERF_OVERLAY_KEY. GameView only times things while enabled is True,
+    so when it's off the only cost is checking enabled
+    """
+    PHASES = ["on_update", "on_draw", "drop", "rotate_shape", "update_board"]
+
+    def __init__(self, size=PERF_BUFFER_SIZE):
+        self.enabled = False
+        self.size = size
+        self.frame_times = None
+        self.phase_times = None
+        self.last_frame = None
+        self.last_text_update = 0
+        self.text = None
+
+    def toggle(self):
+        """ Turn the overlay on or off. Starts with empty buffers each time it's turned on """
+        self.enabled = not self.enabled
+        if self.enabled:
+            self.frame_times = RingBuffer(self.size)
+            self.phase_times = {phase: RingBuffer(self.size) for phase in self.PHASES}
+            self.last_frame = None
+            self.last_text_update = 0
+            self.text = arcade.Text("", 10, SCREEN_HEIGHT - 20, arcade.color.WHITE, 10,
+                                    width=SCREEN_WIDTH - 20, multiline=True, font_name="Courier New")
+
+    def add(self, phase, start):
+        """ Record how long phase took, from start (from time.perf_counter_ns) to now """
+        self.phase_times[phase].add(time.perf_counter_ns() - start)
+
+    def frame(self):
+        """ Called once a frame - records the time since the last one """
+        now = time.perf_counter_ns()
+        if self.last_frame is not None:
+            self.frame_times.add(now - self.last_frame)
+        self.last_frame = now
+
+    def draw(self):
+        """ Draw the overlay. The numbers are only re-worked out a few times a second as laying out text is slow """
+        now = time.perf_counter_ns()
+        if now - self.last_text_update > PERF_TEXT_INTERVAL:
+            self.last_text_update = now
+            frame_times = self.frame_times
+            mean = frame_times.mean()
+            lines = ["FPS {:6.1f}   frame ms p50 {:6.2f}  p95 {:6.2f}  p99 {:6.2f}".format(
+                1e9 / mean if mean else 0, frame_times.percentile(50) / 1e6,
+                frame_times.percentile(95) / 1e6, frame_times.percentile(99) / 1e6)]
+            for phase in self.PHASES:
+                times = self.phase_times[phase]
+                lines.append("{:<13} ms p50 {:6.3f}  p95 {:6.3f}  p99 {:6.3f}".format(
+                    phase, times.percentile(50) / 1e6, times.percentile(95) / 1e6, times.percentile(99) / 1e6))
+            self.text.text = "\n".join(lines)
+        arcade.draw_lrtb_rectangle_filled(0, SCREEN_WIDTH, SCREEN_HEIGHT, SCREEN_HEIGHT - 110, (0, 0, 0, 180))
+        self.text.draw()
+
+
+class MusicLoader:
+    """
+    Loads the songs in MUSIC_LIST on a background thread, so opening and starting to decode
+    a song never stalls the game. A streaming sound can only be played once, so each load is
+    handed out once by take - preload the next song while this one is playing
+    """
+
+    def __init__(self):
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        # Future of the loaded arcade.Sound for each song index being loaded
+        self.songs = {}
+
+    def preload(self, index):
+        """ Start loading song index in the background if it isn't already """
+        if index not in self.songs:
+            self.songs[index] = self.executor.submit(arcade.Sound, MUSIC_LIST[index], streaming=True)
+
+    def take(self, index):
+        """ Returns a future of the loaded song index. Starts loading it if it wasn't preloaded """
+        self.preload(index)
+        return self.songs.pop(index)
+
+    def close(self):
+        """ Stop the background thread once it has finished what it's loading """
+        self.executor.shutdown(wait=False)
+
+
 class GameView(arcade.View):
     """
     Main Application class for game
     Has multiple in-built functions from arcade library
+    The game rules are in TetrisEngine, this drives it and draws it
     """
 
-    def __init__(self):
-        """ Initializer class. Code to be ran on launch """
+    def __init__(self, seed=None, replay=None, replay_speed=1, logic_hz=LOGIC_HZ, board_renderer=SPRITE_BOARD):
+        """
+        Initializer class. Code to be ran on launch
+        :param seed: seed for the shapes, a random one is picked each game if it's None
+        :param replay: a Recording to play back instead of taking input from the keyboard
+        :param replay_speed: speed to play the replay at, 2 is twice as fast
+        :param logic_hz: how many times a second the game logic runs (a replay uses its own)
+        :param board_renderer: SPRITE_BOARD or SHADER_BOARD, how the board is drawn
+        """
         super().__init__()
+        if board_renderer not in BOARD_RENDERERS:
+            raise ValueError("Unknown board renderer {!r}, use one of {}".format(
+                board_renderer, ", ".join(BOARD_RENDERERS)))
         # Load background colors
         self.dark_background = (47, 64, 77)
         self.light_background = arcade.color.LIGHT_STEEL_BLUE
 
         # Load our variables
-        self.board = None
+        self.engine = TetrisEngine()
+        self.engine.on_lines_cleared = self.lines_cleared
         self.board_sprite_list = None
+        self.board_renderer = board_renderer
+        self.board_shader = None
         self.next_board = None
 
-        self.shape = None
-        self.shape_x = 0
-        self.shape_y = 0
-        self.next_shape = None
-
-        self.frame_count = 0
-
+        # Sprites for the tiles of the ghost, falling and next shapes - all drawn from one list
+        self.shape_sprite_list = None
+        self.ghost_sprites = None
+        self.falling_sprites = None
+        self.next_sprites = None
+        # What the shape sprites were last placed for, so they only move when the shapes do
+        self.shape_sprites_state = None
+
+        # Everything on the HUD that doesn't change during a game (the labels and the
+        # black box behind the next shape), made once by build_static_layer
+        self.static_shapes = None
+        self.static_labels = None
         self.score_text = None
         self.lvl_text = None
+        self.next_text = None
+        self.controls_text = None
+
+        # Text objects for the score and level - only changed when the score or level does
         self.score_num_text = None
         self.level_num_text = None
         self.text_color = None
 
-        self.game_over = False
-
         # Variables used to manage our music.
         # -- from https://api.arcade.academy/en/latest/examples/background_music.html#background-music
         self.current_song_index = 0
         self.current_player = None
         self.music = None
+        # Songs are loaded in the background - the future of the song waiting to start
+        self.music_loader = MusicLoader()
+        self.pending_song = None
         self.volume = 0.25
         self.mute = bool
-        self.clear_sound = arcade.load_sound("resources/my_sounds/ruler_swoop.mp3")
+        self.clear_sound = asset_cache.sound(CLEAR_SOUND)
 
         self.dark_mode = bool
 
-        self.level = 0
-        self.score = 0
-        self.rotation = 0
+        # Frame and phase timings, shown with PERF_OVERLAY_KEY
+        self.perf = PerfOverlay()
+
+        # Timers for key auto-repeat - the engine has its own for the game
+        self.scheduler = Scheduler()
+        # The auto-repeat timer of each held key
+        self.repeat_timers = {}
+
+        # Every game is recorded so it can be replayed
+        self.seed = seed
+        self.recording = None
+        self.replay = replay
+        self.replay_speed = replay_speed
+        # The next action of the replay to play
+        self.replay_action = 0
+        if replay:
+            self.seed = replay.seed
+            logic_hz = replay.logic_hz
+        if logic_hz <= 0:
+            raise ValueError("logic_hz must be more than 0, not {!r}".format(logic_hz))
+
+        # The logic runs in fixed steps - time owed to it is kept in the accumulator until
+        # there is a whole step of it. The falling shape as it was before the last step is
+        # kept so it can be drawn part way between the two
+        self.logic_hz = logic_hz
+        self.logic_steps = 0
+        self.accumulator = 0.0
+        self.previous_shape = None
 
     def setup(self):
         """ Set up the game variables. Call to re-start the game. """
-        # Create sprites and sprite lists here
-        # Create a list containing the board (bunch of 0's with some 1's)
-        self.board = new_board(ROW_COUNT, COL_COUNT, False)
-        if not self.dark_mode:
-            arcade.set_background_color(self.light_background)
+        # The generator picks a seed if we don't have one, it's saved so the game can be played again
+        self.engine.seed = self.seed
+        if self.replay:
+            self.engine.mode = self.replay.mode
+        self.engine.setup()
+        self.recording = Recording(self.engine.generator.seed, self.engine.mode, self.logic_hz)
+        self.replay_action = 0
+        self.logic_steps = 0
+        self.accumulator = 0.0
+        self.previous_shape = None
+
+        if self.board_renderer == SHADER_BOARD:
+            self.board_shader = BoardRenderer(self.window.ctx, len(self.engine.board), len(self.engine.board[0]))
         else:
-            arcade.set_background_color(self.dark_background)
-
-        # For each row, and each column in that row, create a sprite and append textures and positions
-        # Just a plain board of squares
-        self.board_sprite_list = arcade.SpriteList()
-        for row in range(len(self.board)):
-            for column in range(len(self.board[0])):
-                sprite = arcade.Sprite()
-                for texture in texture_list:
-                    sprite.append_texture(texture)
-                # Background colors
-                sprite.set_texture(0)
-                sprite.center_x = (MARGIN + WIDTH) * column + MARGIN + WIDTH // 2
-                sprite.center_y = SCREEN_HEIGHT - (MARGIN + HEIGHT) * row + MARGIN + HEIGHT // 2
-                self.board_sprite_list.append(sprite)
+            # For each row, and each column in that row, create a sprite and set its color and position
+            # Just a plain board of squares
+            self.board_sprite_list = arcade.SpriteList()
+            for row in range(len(self.engine.board)):
+                for column in range(len(self.engine.board[0])):
+                    sprite = arcade.Sprite(texture=asset_cache.box_texture())
+                    # Background colors
+                    sprite.color = COLORS[0]
+                    sprite.center_x = (MARGIN + WIDTH) * column + MARGIN + WIDTH // 2
+                    sprite.center_y = SCREEN_HEIGHT - (MARGIN + HEIGHT) * row + MARGIN + HEIGHT // 2
+                    self.board_sprite_list.append(sprite)
 
         # Create our next board
         self.next_board = new_board(4, 4, True)
 
+        # 4 tile sprites each for the ghost, falling and next shapes. The ghost is first
+        # so the falling shape is drawn over it
+        self.shape_sprite_list = arcade.SpriteList()
+        self.ghost_sprites = self.create_shape_sprites(GHOST_ALPHA)
+        self.falling_sprites = self.create_shape_sprites()
+        self.next_sprites = self.create_shape_sprites()
+        self.shape_sprites_state = None
+
         # Play music
         # current_song_index is what to play
         self.current_song_index = random.randint(0, len(MUSIC_LIST) - 1)
@@ -554,293 +735,384 @@ class GameView(arcade.View):
             self.volume = 0
         self.play_song()
 
-        self.level = 1
-        self.score = 0
+        self.set_dark_mode(self.dark_mode)
+
+        self.update_board()
+
+    def set_dark_mode(self, dark_mode):
+        """ Change to dark or light colors. Re-makes the static layer and text in the new text color """
+        self.dark_mode = dark_mode
+        if not self.dark_mode:
+            arcade.set_background_color(self.light_background)
+        else:
+            arcade.set_background_color(self.dark_background)
 
         # Figure out our text color
         self.text_color = (247, 147, 30)
         if not self.dark_mode:
             self.text_color = (47, 64, 77)
 
-        # Load our shapes and update board
-        self.next_shape = SHAPES[random.randint(0, 6)]
-        self.new_shape()
-        self.update_board()
+        self.build_static_layer()
+        self.create_text()
 
-    def new_shape(self):
-        """ Randomly select new shape - create at top of screen"""
-        self.shape = self.next_shape
-        self.next_shape = random.choice(SHAPES)
+    def build_static_layer(self):
+        """
+        Make everything on the HUD that doesn't change during a game - the black box to display our
+        next shapes in a shape element list, and the labels in one pyglet batch, so each is a
+        single draw call a frame. Only re-made when the colors change or the window is resized
+        """
+        self.static_shapes = arcade.ShapeElementList()
+        self.static_shapes.append(arcade.create_rectangle_filled(457.5, 442 - 35, 145, 105, (0, 0, 0)))
+
+        self.static_labels = pyglet.graphics.Batch()
+        label_color = self.text_color + (255,)
+        self.lvl_text = pyglet.text.Label("LEVEL:",
+                                          x=LEVEL_TEXT_XY[0], y=LEVEL_TEXT_XY[1],
+                                          color=label_color, font_size=TITLE_FONT_SIZE,
+                                          font_name="Neuropol Nova Regular", batch=self.static_labels)
+
+        self.score_text = pyglet.text.Label("SCORE:",
+                                            x=SCORE_TEXT_XY[0], y=SCORE_TEXT_XY[1],
+                                            color=label_color, font_size=TITLE_FONT_SIZE,
+                                            font_name="Neuropol Nova Regular", batch=self.static_labels)
+
+        self.next_text = pyglet.text.Label("NEXT:",
+                                           x=SCORE_NUM_TEXT_XY[0], y=470,
+                                           color=label_color, font_size=TITLE_FONT_SIZE,
+                                           font_name="Neuropol Nova Regular", batch=self.static_labels)
+
+        # User control instructions at bottom
+        # Multiline so the line breaks show, and wrapped to fit beside the board
+        self.controls_text = pyglet.text.Label("CONTROLS:\n"
+                                               "Z  X to rotate.\n"
+                                               "L  R arrow keys to move sideways.\n"
+                                               "DOWN arrow key to drop.\n"
+                                               "SPACE to hard drop.\n"
+                                               "M to mute.",
+                                               x=SCORE_NUM_TEXT_XY[0], y=CONTROLS_TEXT_Y, anchor_y="top",
+                                               color=label_color, font_size=TITLE_FONT_SIZE - 9,
+                                               font_name="Neuropol Nova Regular", batch=self.static_labels,
+                                               multiline=True, width=180)
+
+    def create_text(self):
+        """
+        Create the score and level text objects. Laying out text is slow so this is done once,
+        and the numbers are changed in update_text when they change
+        """
+        self.level_num_text = arcade.Text(str(self.engine.level),
+                                          LEVEL_NUM_TEXT_XY[0], LEVEL_NUM_TEXT_XY[1],
+                                          self.text_color, TITLE_FONT_SIZE, font_name="Neuropol Nova Regular")
+
+        self.score_num_text = arcade.Text(str(self.engine.score),
+                                          SCORE_NUM_TEXT_XY[0], SCORE_NUM_TEXT_XY[1],
+                                          self.text_color, TITLE_FONT_SIZE, font_name="Neuropol Nova Regular")
+
+    def on_resize(self, width, height):
+        """ Called when the window is resized - re-make the static layer for the new size """
+        super().on_resize(width, height)
+        if self.static_shapes:
+            self.build_static_layer()
+
+    def update_text(self):
+        """ Change the score and level text to the engine's. Only re-lays out the text if it changed """
+        level = str(self.engine.level)
+        if self.level_num_text.text != level:
+            self.level_num_text.text = level
+        score = str(self.engine.score)
+        if self.score_num_text.text != score:
+            self.score_num_text.text = score
+
+    def create_shape_sprites(self, alpha=255):
+        """
+        Create 4 tile sprites (one shape) and add them to the shape sprite list.
+        Alpha is how see through the tiles are, used for the ghost shape
+        """
+        sprites = []
+        for _tile in range(4):
+            sprite = arcade.Sprite(texture=asset_cache.box_texture())
+            sprite.color = COLORS[0]
+            sprite.alpha = alpha
+            sprites.append(sprite)
+            self.shape_sprite_list.append(sprite)
+        return sprites
 
-        # Work out the x value - take it from the middle of columns rounded to the left
-        self.shape_x = int(COL_COUNT / 2 - len(self.shape[0]) + 1)
-        self.shape_y = 0
-        self.rotation = 0
+    # noinspection PyMethodMayBeStatic
+    def place_shape_sprites(self, sprites, shape_matrix, offset_x, offset_y):
+        """
+        Move a shape's tile sprites to draw the shape matrix over the board at the offset.
+        Used for the falling shapes. The board is drawn by the board sprite list.
+        PREVIOUSLY draw_shapes
+        """
+        tiles = ((row, column) for row in range(len(shape_matrix)) for column in range(len(shape_matrix[0]))
+                 if shape_matrix[row][column])
+        for sprite, (row, column) in zip(sprites, tiles):
+            # Gets the number of a place in the matrix (eg 1) and selects the corresponding color
+            sprite.color = COLORS[shape_matrix[row][column]]
 
-        # Collision checking for game over
-        if check_collision(self.board, self.shape, (self.shape_x, self.shape_y)):
-            self.game_over = True
+            # Do the math to figure out where the box is
+            sprite.center_x = (MARGIN + WIDTH) * (column + offset_x) + MARGIN + WIDTH // 2
+            sprite.center_y = SCREEN_HEIGHT - (MARGIN + HEIGHT) * (row + offset_y) + MARGIN + HEIGHT // 2
 
-    # noinspection PyMethodMayBeStatic
-    def draw_shapes(self, shape_matrix, offset_x, offset_y):
+    def update_shape_sprites(self, alpha=1.0):
         """
-        Draw the shape matrix over the board. Used to draw the falling shapes. The board is drawn
-        by the sprite list. PREVIOUSLY draw_grid
+        Move the ghost, falling and next shape sprites, only if any of the shapes have changed.
+        Alpha is how far through the next logic step we are (0 - 1). If the last step moved the falling
+        shape down a row it's drawn that far between where it was and where it is now
         """
-        # Draw the grid/shapes
-        # break down the matrix into each number and draw accordingly
-        for row in range(len(shape_matrix)):
-            for column in range(len(shape_matrix[0])):
-                # Figure out what color to draw the box
-                if shape_matrix[row][column]:
-                    # Gets the number of a place in the matrix (eg 1) and selects the corresponding color
-                    color = COLORS[shape_matrix[row][column]]
-
-                    # Do the math to figure out where the box is
-                    x = (MARGIN + WIDTH) * (column + offset_x) + MARGIN + WIDTH // 2
-                    y = SCREEN_HEIGHT - (MARGIN + HEIGHT) * (row + offset_y) + MARGIN + HEIGHT // 2
-
-                    # Draw the box
-                    arcade.draw_rectangle_filled(x, y, WIDTH, HEIGHT, color)
+        engine = self.engine
+        shape_y = engine.shape_y
+        if self.previous_shape:
+            piece, rotation, shape_x, previous_y = self.previous_shape
+            if (piece, rotation, shape_x) == (engine.piece, engine.rotation, engine.shape_x) \
+                    and shape_y - previous_y == 1:
+                shape_y = previous_y + alpha
+        # Landing y is kept by the engine so this is cheap, and it changes when the board does
+        landing_y = engine.landing_y()
+        state = (engine.piece, engine.rotation, engine.shape_x, shape_y, landing_y, engine.next_piece)
+        if state == self.shape_sprites_state:
+            return
+        self.shape_sprites_state = state
+
+        # Ghost shape where the falling shape will land
+        self.place_shape_sprites(self.ghost_sprites, engine.shape, engine.shape_x, landing_y)
+        self.place_shape_sprites(self.falling_sprites, engine.shape, engine.shape_x, shape_y)
+        self.place_shape_sprites(self.next_sprites, engine.next_shape, 11, 11)
 
     def on_draw(self):
         """ Render the screen """
+        perf = self.perf
+        if perf.enabled:
+            start = time.perf_counter_ns()
+            perf.frame()
+
         # This command should happen before we start drawing. It will clear
         # the screen to the background color, and erase what we drew last frame.
         arcade.start_render()
 
-        # Draw main board and shapes
-        self.board_sprite_list.draw()
-        self.draw_shapes(self.shape, self.shape_x, self.shape_y)
-
-        # Draw Level and Score text
-        arcade.draw_text("LEVEL:",
-                         LEVEL_TEXT_XY[0], LEVEL_TEXT_XY[1],
-                         self.text_color, TITLE_FONT_SIZE, font_name="Neuropol Nova Regular")
-
-        arcade.draw_text(str(self.level),
-                         LEVEL_NUM_TEXT_XY[0], LEVEL_NUM_TEXT_XY[1],
-                         self.text_color, TITLE_FONT_SIZE, font_name="Neuropol Nova Regular")
+        # Draw main board, the static layer (black background to display our next shapes
+        # and the labels), then the shapes over them
+        if self.board_shader:
+            self.board_shader.draw()
+        else:
+            self.board_sprite_list.draw()
+        self.static_shapes.draw()
+        with self.window.ctx.pyglet_rendering():
+            self.static_labels.draw()
+        self.update_shape_sprites(self.accumulator * self.logic_hz)
+        self.shape_sprite_list.draw()
+
+        # Draw the Level and Score numbers
+        self.level_num_text.draw()
+        self.score_num_text.draw()
+
+        if perf.enabled:
+            perf.add("on_draw", start)
+            perf.draw()
+
+    def drop(self, hard_drop=False):
+        """ Drop the tetromino down one space, or all the way if hard_drop. Update the sprite list if it locked """
+        perf = self.perf
+        if perf.enabled:
+            start = time.perf_counter_ns()
+
+        if hard_drop:
+            locked = self.engine.hard_drop()
+        else:
+            locked = self.engine.soft_drop()
+        if locked:
+            self.update_board()
 
-        arcade.draw_text("SCORE:",
-                         SCORE_TEXT_XY[0], SCORE_TEXT_XY[1],
-                         self.text_color, TITLE_FONT_SIZE, font_name="Neuropol Nova Regular")
+        if perf.enabled:
+            perf.add("drop", start)
 
-        arcade.draw_text(str(self.score),
-                         SCORE_NUM_TEXT_XY[0], SCORE_NUM_TEXT_XY[1],
-                         self.text_color, TITLE_FONT_SIZE, font_name="Neuropol Nova Regular")
-
-        # Draw next shape and black background to display our next shapes
-        arcade.draw_text("NEXT:",
-                         SCORE_NUM_TEXT_XY[0], 470,
-                         self.text_color, TITLE_FONT_SIZE, font_name="Neuropol Nova Regular")
-        arcade.draw_rectangle_filled(457.5, 442 - 35, 145, 105, (0, 0, 0))
-        self.draw_shapes(self.next_shape, 11, 11)
-
-        # Draw user control instructions at bottom
-        arcade.draw_text("CONTROLS:\n\n"
-                         "Z  X to rotate.\n\n"
-                         "L  R arrow keys \n"
-                         "to move sideways.\n\n"
-                         "DOWN arrow key \n"
-                         "to drop.\n\n"
-                         "M to mute.",
-                         SCORE_NUM_TEXT_XY[0], 100,
-                         self.text_color, TITLE_FONT_SIZE - 7, font_name="Neuropol Nova Regular")
-
-    def drop(self):
+    def lines_cleared(self, lines):
         """
-        Drop the tetromino down one space.
-        Check for collision:
-        If collision:
-            Join matrices
-            Check if line can be cleared
-            Update sprite list with new shape
-            Create a new sprite
+        Called by the engine once after a drop clears lines, with the number of lines cleared.
+        Updates the score and level text and plays the clear sound
         """
-        if not self.game_over:
-            # Drop shape down by 1
-            self.shape_y += 1
-            # Check if the shape collides with anything on the board
-            if check_collision(self.board, self.shape, (self.shape_x, self.shape_y)):
-                self.board = join_matrixes(self.board, self.shape, (self.shape_x, self.shape_y))
-                # Loop to check for line clearing
-                while True:
-                    # self.board[:-1] makes sure our bottom row doesnt get deleted (checks every row except the last)
-                    for row_num, row in enumerate(self.board[:-1]):
-                        # if row doesnt have a 0 - delete it
-                        if 0 not in row:
-                            self.board = remove_row(self.board, row_num)
-                            self.score += int(200 / self.level)
-
-                            arcade.play_sound(self.clear_sound, 0.5)
-                            self.level = check_level(self.level, self.score)
-                            break
-                    else:
-                        break
-
-                self.update_board()
-                self.new_shape()
+        self.update_text()
+        arcade.play_sound(self.clear_sound, 0.5)
 
     def rotate_shape(self, rotate_anticlockwise):
-        """
-        Rotate the shape and re-draw it
-        This is done by creating a new matrix, rotating each individual tile relative to a
-        center block, putting them back into the matrix and redrawing it on the board
-        """
-        if not self.game_over:
-            # Create an empty matrix to load our rotated tiles into
-            new_shape_matrix = [[0, 0, 0, 0],
-                                [0, 0, 0, 0],
-                                [0, 0, 0, 0],
-                                [0, 0, 0, 0]]
-            # Remember current rotation
-            old_rotation = self.rotation
-            # Find the new rotation - between 0 and 3
-            new_rotation = calculate_rotation_num(rotate_anticlockwise, self.rotation)
-            # Get shape type from center so we can re-color our new shape
-            shape_type = self.shape[1][1]
-
-            # Count_x, count_y is the x,y coordinates in the matrix
-            # For each tile in the shape
-            for count_y, row in enumerate(self.shape):
-                for count_x, tile in enumerate(row):
-                    # Filter out any 0's to get each tile
-                    if tile:
-                        # Find the new x and y coordinates of each tile
-                        new_x, new_y = get_rotated_tile((count_x, count_y), (1, 1), rotate_anticlockwise)
-                        # Add newly rotated tile to our matrix as the shape type
-                        new_shape_matrix[new_y][new_x] = shape_type
-            # Set the shape to the new matrix and update the board
-            self.shape = new_shape_matrix
-            self.rotation = new_rotation
-
-            # Prevent the O shape from wobbling
-            if shape_type == 7:
-                # Get an offset based on shapes old and new rotation positions
-                shape_x_offset, shape_y_offset = offset_o(old_rotation, self.rotation)
-                self.shape_x += shape_x_offset
-                self.shape_y += shape_y_offset
-
-            # Check we didn't rotate off the board
-            for count_y, y in enumerate(self.shape):
-                for count_x, x in enumerate(y):
-                    if x != 0:
-                        if get_tile_coordinates_global((count_x, count_y), (self.shape_x, self.shape_y))[0] < 0:
-                            # Check we don't rotate into another block
-                            self.shape_x = self.shape_x + 1
-                            if check_collision(self.board, self.shape, (self.shape_x, self.shape_y)):
-                                self.shape_x = self.shape_x - 1
-                                self.rotate_shape(not rotate_anticlockwise)
-
-            # If a collision occurs - rotate shape back the opposite way.
-            if check_collision(self.board, self.shape, (self.shape_x, self.shape_y)):
-                self.rotate_shape(not rotate_anticlockwise)
+        """ Rotate the shape. The falling shape isn't part of the board so the sprites don't change """
+        perf = self.perf
+        if perf.enabled:
+            start = time.perf_counter_ns()
 
-            self.update_board()
+        self.engine.rotate(rotate_anticlockwise)
+
+        if perf.enabled:
+            perf.add("rotate_shape", start)
 
     def update_board(self):
         """
-         Update the sprite list to reflect the contents of the 2d grid
+         Update the sprite list (or the shader board's cell texture) to reflect the contents of the 2d grid
+         Only the cells that have changed since the last update are touched
         """
-        for row in range(len(self.board)):
-            for column in range(len(self.board[0])):
-                v = self.board[row][column]  # v = the number at each box location eg 0 or 1
-                i = row * COL_COUNT + column  # i = position of each box within the sprite list
-                self.board_sprite_list[i].set_texture(v)
+        perf = self.perf
+        if perf.enabled:
+            start = time.perf_counter_ns()
+
+        board = self.engine.board
+        dirty_rows, dirty_cells = self.engine.get_dirty()
+        if self.board_shader:
+            self.board_shader.update(board, dirty_rows, dirty_cells)
+        else:
+            # Whole rows that changed (moved down by a line clear or a new board)
+            for row in range(dirty_rows):
+                for column in range(len(board[0])):
+                    v = board[row][column]  # v = the number at each box location eg 0 or 1
+                    i = row * COL_COUNT + column  # i = position of each box within the sprite list
+                    self.board_sprite_list[i].color = COLORS[v]
+            # Single cells that changed below them
+            for row, column in dirty_cells:
+                if row >= dirty_rows:
+                    self.board_sprite_list[row * COL_COUNT + column].color = COLORS[board[row][column]]
+
+        if perf.enabled:
+            perf.add("update_board", start)
 
     def on_update(self, delta_time):
         """
-        Logic to keep track of time, drop the stone at set times
-        Contains different times for different levels
+        Logic to keep track of time, the engine drops the stone at set times
         Game-over checking logic
         """
-        self.frame_count += 1
-
-        # Check what level we are on and drop at the corresponding frequency.
-        if self.level == 1:
-            if self.frame_count % 60 == 0:
-                self.drop()
-        elif self.level == 2:
-            if self.frame_count % 45 == 0:
-                self.drop()
-        elif self.level == 3:
-            if self.frame_count % 30 == 0:
-                self.drop()
-        elif self.level == 4:
-            if self.frame_count % 20 == 0:
-                self.drop()
-        elif self.level == 5:
-            if self.frame_count % 15 == 0:
-                self.drop()
-        elif self.level == 6:
-            if self.frame_count % 10 == 0:
-                self.drop()
-        elif self.level == 7:
-            if self.frame_count % 5 == 0:
-                self.drop()
-
-        position = self.music.get_stream_position(self.current_player)
-        if position == 0.0:
-            self.advance_song()
-            self.play_song()
-
-        if self.game_over:
+        perf = self.perf
+        if perf.enabled:
+            start = time.perf_counter_ns()
+
+        # Run as many fixed logic steps as this frame's time pays for
+        step_time = 1 / self.logic_hz
+        max_steps = max(1, int(MAX_CATCH_UP_TIME * self.logic_hz))
+        if self.replay:
+            self.accumulator += delta_time * self.replay_speed
+            max_steps = max(1, int(MAX_CATCH_UP_TIME * self.logic_hz * max(self.replay_speed, 1)))
+        else:
+            self.accumulator += delta_time
+        # Start the next song once it has loaded
+        if self.pending_song and self.pending_song.done():
+            self.start_song()
+
+        steps = 0
+        while self.accumulator >= step_time and not self.engine.game_over:
+            if steps == max_steps:
+                # Too far behind to catch up - drop the time owed
+                self.accumulator = 0.0
+                break
+            self.logic_step()
+            self.accumulator -= step_time
+            steps += 1
+
+        if self.engine.game_over:
+            if not self.replay:
+                self.recording.steps = self.logic_steps
+                self.recording.save(REPLAY_FILE)
             view = GameOverView()
             view.mute = self.mute
-            view.score = self.score
-            self.music.stop(self.current_player)
+            view.dark_mode = self.dark_mode
+            view.logic_hz = self.logic_hz
+            view.board_renderer = self.board_renderer
+            view.score = self.engine.score
+            self.stop_song()
+            self.music_loader.close()
             self.window.show_view(view)
 
+        if perf.enabled:
+            perf.add("on_update", start)
+
+    def logic_step(self):
+        """ Run the game logic for one fixed step - replay actions, key auto-repeat timers, then the engine """
+        if self.replay:
+            # Do the actions recorded before this step. Stop when the recording does
+            actions = self.replay.actions
+            while self.replay_action < len(actions) and actions[self.replay_action][0] <= self.logic_steps:
+                self.do_action(actions[self.replay_action][1])
+                self.replay_action += 1
+            if self.logic_steps >= self.replay.steps:
+                return
+
+        engine = self.engine
+        # Worked out from the step count (not added up) so replays come out exactly the same
+        game_time = (self.logic_steps + 1) / self.logic_hz
+        # Key auto-repeat before the step count goes up, so repeats are recorded on the
+        # same step as the engine state they were done to, like key presses are
+        self.scheduler.advance_to(game_time)
+        self.previous_shape = (engine.piece, engine.rotation, engine.shape_x, engine.shape_y)
+        self.logic_steps += 1
+        if engine.run_until(game_time):
+            self.update_board()
+
     def move(self, x_value):
         """
         :param x_value: delta x - the amount to move the shape across by
-        :return: changes self.shape.x to the new_x value
         """
-        if not self.game_over:
-            # Set the new x value to current + amount to change
-            new_x = self.shape_x + x_value
-            # If it exceeds either boundary - set to boundary
-            for count_y, y in enumerate(self.shape):
-                for count_x, x in enumerate(y):
-                    if x != 0:
-                        if get_tile_coordinates_global((count_x, count_y), (new_x, self.shape_y))[0] < 0:
-                            new_x = self.shape_x
-
-            # If not colliding - change position
-            if not check_collision(self.board, self.shape, (self.shape_x + x_value, self.shape_y)):
-                self.shape_x = new_x
+        self.engine.move(x_value)
 
-    def on_key_press(self, key, key_modifiers):
-        """
-        Called whenever a key on the keyboard is pressed.
-        """
+    def do_action(self, action):
+        """ Do one of the player's actions (from KEY_ACTIONS) and record it with the game time it was done at """
+        if not self.replay:
+            self.recording.add(self.logic_steps, action)
         # Drop the shape down by 1 each key press
-        if key == arcade.key.DOWN:
-            new_y = self.shape_y + 1
-            if not check_collision(self.board, self.shape, (self.shape_x, new_y)):
-                self.shape_y = new_y
+        if action == "soft_drop":
             self.drop()
+        # Drop the shape all the way down
+        elif action == "hard_drop":
+            self.drop(True)
         # Move left and right
-        if key == arcade.key.LEFT:
+        elif action == "left":
             self.move(-1)
-        if key == arcade.key.RIGHT:
+        elif action == "right":
             self.move(1)
         # Rotate shapes clockwise or anti-clockwise
-        if key == arcade.key.Z:
+        elif action == "rotate_anticlockwise":
             self.rotate_shape(True)
-        if key == arcade.key.X:
+        elif action == "rotate_clockwise":
             self.rotate_shape(False)
+
+    def on_key_press(self, key, key_modifiers):
+        """
+        Called whenever a key on the keyboard is pressed.
+        """
+        # Moving the shape - not while a replay is playing
+        if key in KEY_ACTIONS and not self.replay:
+            self.do_action(KEY_ACTIONS[key])
+            # Keep doing it while the key is held down
+            if key in REPEAT_KEYS:
+                self.scheduler.cancel(self.repeat_timers.get(key))
+                self.repeat_timers[key] = self.scheduler.schedule(KEY_REPEAT_DELAY, lambda: self.repeat_key(key))
         # Mute
         if key == arcade.key.M:
             if not self.mute:
                 self.mute = True
-                self.music.stop(self.current_player)
+                self.stop_song()
             else:
                 self.mute = False
                 self.current_song_index = random.randint(0, len(MUSIC_LIST) - 1)
                 self.volume = 0.25
                 self.play_song()
+        # Show or hide the frame timings
+        if key == PERF_OVERLAY_KEY:
+            self.perf.toggle()
+
+    def on_key_release(self, key, key_modifiers):
+        """ Called whenever a key is released - stops it auto-repeating """
+        self.scheduler.cancel(self.repeat_timers.pop(key, None))
+
+    def repeat_key(self, key):
+        """ Auto-repeat timer for a held key - do its action again and time the next repeat """
+        self.do_action(KEY_ACTIONS[key])
+        self.repeat_timers[key] = self.scheduler.schedule(KEY_REPEAT_INTERVAL, lambda: self.repeat_key(key))
+
+    def song_finished(self, player):
+        """ Called by the player when a song reaches its end - play the next one """
+        # Ignore a song that was stopped or replaced since
+        if player is not self.current_player or not self.music:
+            return
+        # It has already ended so don't stop it - arcade cleans the player up after this event
+        self.music = None
+        self.current_player = None
+        self.advance_song()
+        self.play_song()
 
     def advance_song(self):
         """ Advance our pointer to the next song. This does NOT start the song. """
@@ -850,21 +1122,51 @@ class GameView(arcade.View):
             self.current_song_index = 0
 
     def play_song(self):
-        """ Play the song. """
+        """
+        Play the song. It's loaded in the background (if it wasn't already) and starts once
+        it has, so this never waits. The song after it starts loading too
+        """
         # Stop what is currently playing.
+        self.stop_song()
+        self.pending_song = self.music_loader.take(self.current_song_index)
+        self.music_loader.preload((self.current_song_index + 1) % len(MUSIC_LIST))
+        if self.pending_song.done():
+            self.start_song()
+
+    def start_song(self):
+        """ Start playing the song that has been loaded """
+        self.music = self.pending_song.result()
+        self.pending_song = None
+        player = self.music.play(self.volume)
+        # The player tells us when the song ends, so we don't need to keep checking
+        player.push_handlers(on_eos=lambda: self.song_finished(player))
+        self.current_player = player
+
+    def stop_song(self):
+        """ Stop the song playing, or the one waiting to start """
         if self.music:
             self.music.stop(self.current_player)
-        # Play the next song
-        self.music = arcade.Sound(MUSIC_LIST[self.current_song_index], streaming=True)
-        self.current_player = self.music.play(self.volume)
-        # Quick delay to prevent accidental skipping
-        time.sleep(0.03)
+            self.music = None
+        self.pending_song = None
 
 
 def main():
     """ Main Method """
+    parser = argparse.ArgumentParser(description="Play Tetris")
+    parser.add_argument("--logic-hz", type=int, default=LOGIC_HZ,
+                        help="times a second the game logic runs (default {})".format(LOGIC_HZ))
+    parser.add_argument("--renderer", default=SPRITE_BOARD, choices=BOARD_RENDERERS,
+                        help="how the board is drawn (default {})".format(SPRITE_BOARD))
+    args = parser.parse_args()
+    if args.logic_hz <= 0:
+        parser.error("--logic-hz must be more than 0")
+
     window = arcade.Window(SCREEN_WIDTH, SCREEN_HEIGHT, TITLE)
+    # Load everything else while the menu is up
+    asset_cache.preload(background=True)
     start_view = MenuView()
+    start_view.logic_hz = args.logic_hz
+    start_view.board_renderer = args.renderer
     window.show_view(start_view)
     start_view.setup()
     arcade.run()
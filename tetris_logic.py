@@ -0,0 +1,996 @@
+"""
+Tetris game logic
+Everything that plays a game of Tetris with no window - the board and bit board functions,
+the rotation tables, the scheduler, the piece generator, TetrisEngine and replays.
+
+It doesn't import arcade or PIL, so scripts and worker processes that only need the
+logic (simulate.py, batch_engine.py, benchmark_logic.py) start quickly. tetris_07 builds
+the game window on top of it.
+"""
+import collections
+import hashlib
+import heapq
+import itertools
+import json
+import os
+import random
+
+# No. rows and columns
+ROW_COUNT = 22
+COL_COUNT = 10
+
+# List containing the different tetrominoes - different numbers for colouring purposes
+# it is done so we know our center piece is always at for shape in shapes -> shape[1][2]
+SHAPES = [[[0, 2, 0],
+           [2, 2, 2]],
+
+          [[0, 0, 3],
+           [3, 3, 3]],
+
+          [[4, 0, 0],
+           [4, 4, 4]],
+
+          [[0, 5, 5],
+           [5, 5, 0]],
+
+          [[6, 6, 0],
+           [0, 6, 6]],
+
+          [[0, 7, 7],
+           [0, 7, 7]],
+
+          [[0, 0, 0, 0],
+           [8, 8, 8, 8]]
+          ]
+
+O_OFFSET_DATA = [[0, 0], [0, 1], [-1, 1], [-1, 0]]
+
+# Bitboard constants
+# Each row of a bit board is one int - bit (column + WALL_BITS) is set if that cell is filled.
+# WALL_BITS filled bits either side of the columns act as the walls, and the bottom row is
+# completely filled to act as the floor, so pieces can never slide or fall off the board.
+WALL_BITS = 4
+WALL_MASK = (1 << WALL_BITS) - 1
+EMPTY_ROW = WALL_MASK | (WALL_MASK << (COL_COUNT + WALL_BITS))
+FULL_ROW = (1 << (COL_COUNT + WALL_BITS * 2)) - 1
+
+
+def new_board(row_count, col_count, is_next):
+    """ Create a grid that is X cols by Y rows filled with 0's. """
+    # Board has 0's equal to the num of columns and num of rows.
+    board = [[0 for _x in range(col_count)] for _y in range(row_count)]
+    if not is_next:
+        # Add 1's on the bottom for easier collision checking
+        board += [[1 for _x in range(col_count)]]
+    # Returns a 2d list of 0's that is full of items col_count in length
+    return board
+
+
+def check_collision(board, shape, offset):
+    """
+    See if the matrix stored in variable shape will intercept with anything
+    on the board based on the offset. Offset is an (x, y).
+    """
+    off_x, off_y = offset
+
+    # Enumerate - "for  count, value  in enumerate(values):"
+    # for each row in shape
+    for count_y, row in enumerate(shape):
+        # for each cell in that row
+        for count_x, cell in enumerate(row):
+            # Try / except to stop IndexError for error control
+            try:
+                # if the cell and the board's (x,y) is not a 0, return True (as it must intersect)
+                if cell and board[count_y + off_y][count_x + off_x]:
+                    return True
+            except IndexError:
+                return True
+    return False
+
+
+def join_matrixes(matrix_1, matrix_2, matrix_2_offset):
+    """
+    :param matrix_1: first matrix - the board
+    :param matrix_2: second matrix - the shape
+    :param matrix_2_offset: the offset of the second matrix - the x and y coordinate of shape (x,y)
+    :return: Returns a new matrix containing both matrix - a new board
+    """
+    offset_x, offset_y = matrix_2_offset
+    for count_y, row in enumerate(matrix_2):
+        for count_x, value in enumerate(row):
+            if value:
+                matrix_1[count_y + offset_y - 1][count_x + offset_x] += value
+    return matrix_1
+
+
+def remove_row(board, row):
+    """ Remove a row from the board, add a blank row on top. """
+    del board[row]
+    return [[0 for _ in range(COL_COUNT)]] + board
+
+
+# BITBOARD FUNCTIONS
+
+def new_bit_board(row_count):
+    """
+    Create a bit board with row_count empty rows (just the wall bits)
+    and a full floor row on the bottom, the same layout as new_board
+    """
+    return [EMPTY_ROW] * row_count + [FULL_ROW]
+
+
+def bit_board_from_board(board):
+    """
+    Make the bit board for a list board (like new_board makes), for starting
+    from a board that wasn't built up with join_bits
+    """
+    bit_board = []
+    for row in board[:-1]:
+        bits = EMPTY_ROW
+        for column, cell in enumerate(row):
+            if cell:
+                bits |= 1 << (column + WALL_BITS)
+        bit_board.append(bits)
+    # The floor
+    bit_board.append(FULL_ROW)
+    return bit_board
+
+
+def get_shape_masks(shape):
+    """
+    Turns a shape matrix into a tuple of row masks, one per row of the shape.
+    Bit x is set if the tile in column x is filled. Masks are not shifted by the walls
+    or the shape's x, that is done when checking/joining with the offset.
+    """
+    masks = []
+    for row in shape:
+        mask = 0
+        for count_x, cell in enumerate(row):
+            if cell:
+                mask |= 1 << count_x
+        masks.append(mask)
+    return tuple(masks)
+
+
+def check_collision_bits(bit_board, shape_masks, offset):
+    """
+    Bit board version of check_collision. Shape masks are from get_shape_masks.
+    Moves each row mask across to the shapes x and ANDs it with the board row it is over,
+    if any bits line up the shape must intersect with a block, wall or the floor.
+    """
+    off_x, off_y = offset
+    shift = off_x + WALL_BITS
+    # Further left than the walls can catch
+    if shift < 0:
+        return True
+
+    for count_y, mask in enumerate(shape_masks):
+        if mask:
+            board_y = count_y + off_y
+            # Above the top or below the floor
+            if board_y < 0 or board_y >= len(bit_board):
+                return True
+            if bit_board[board_y] & (mask << shift):
+                return True
+    return False
+
+
+def join_bits(bit_board, shape_masks, offset):
+    """
+    Bit board version of join_matrixes - OR the shape into the board.
+    Uses the same offset as join_matrixes (the y is the row the shape collided on)
+    """
+    off_x, off_y = offset
+    shift = off_x + WALL_BITS
+    for count_y, mask in enumerate(shape_masks):
+        if mask:
+            bit_board[count_y + off_y - 1] |= mask << shift
+    return bit_board
+
+
+def clear_lines(board, bit_board):
+    """
+    Removes every full row from the board and bit board in one pass.
+    Works up from the bottom (above the floor) copying each row that isn't full down
+    over the cleared ones, then fills the rows left at the top with empty rows.
+    Both boards are changed in place. Returns the number of rows cleared.
+    """
+    lines = 0
+    # The floor row never gets deleted so start on the row above it
+    write_row = len(bit_board) - 2
+    for row_num in range(len(bit_board) - 2, -1, -1):
+        # if every bit in the row is set - skip it so it gets written over
+        if bit_board[row_num] == FULL_ROW:
+            lines += 1
+        else:
+            if lines:
+                board[write_row] = board[row_num]
+                bit_board[write_row] = bit_board[row_num]
+            write_row -= 1
+
+    # Rows moved down leave room for a blank row at the top for every line cleared
+    for row_num in range(lines):
+        board[row_num] = [0 for _ in range(len(board[0]))]
+        bit_board[row_num] = EMPTY_ROW
+    return lines
+
+
+# COLUMN HEIGHT FUNCTIONS
+# Heights are how many rows up from the floor the top block of each column is, 0 if it's empty.
+# They are kept up to date as shapes lock so where a shape lands can be worked out without
+# moving it down one row at a time.
+
+def get_heights(bit_board):
+    """ Works out the height of every column from a bit board """
+    heights = [0 for _ in range(COL_COUNT)]
+    # Bits of the columns we have already found the top of - start with the walls
+    covered = EMPTY_ROW
+    for row_num, row in enumerate(bit_board[:-1]):
+        new_columns = row & ~covered
+        if new_columns:
+            for column in range(COL_COUNT):
+                if new_columns >> (column + WALL_BITS) & 1:
+                    heights[column] = ROW_COUNT - row_num
+            covered |= row
+            # Found the top of every column
+            if covered == FULL_ROW:
+                break
+    return heights
+
+
+def join_heights(heights, shape_profile, offset):
+    """
+    Update the column heights for a shape being joined onto the board.
+    Shape profile is from get_shape_profile, offset is the same as join_matrixes
+    """
+    offset_x, offset_y = offset
+    for column, top, _bottom in shape_profile:
+        height = ROW_COUNT - (top + offset_y - 1)
+        if height > heights[column + offset_x]:
+            heights[column + offset_x] = height
+    return heights
+
+
+def get_landing_y(bit_board, heights, shape_masks, shape_profile, offset):
+    """
+    Works out the y a shape at offset will lock at if it is dropped straight down.
+    The shape lands when the bottom tile of one of its columns hits the top of that column,
+    so this is one sum per column. If the shape is tucked under an overhang the heights are
+    above it, so it falls back to moving down one row at a time.
+    """
+    shape_x, shape_y = offset
+    landing_y = min(ROW_COUNT - heights[shape_x + column] - 1 - bottom for column, _top, bottom in shape_profile)
+    if landing_y < shape_y:
+        landing_y = shape_y
+        while not check_collision_bits(bit_board, shape_masks, (shape_x, landing_y + 1)):
+            landing_y += 1
+    return landing_y
+
+
+def check_level(level, score):
+    """
+    Checks current level and sees if we need to
+    increase level based on score
+    """
+    if level == 1:
+        if score > 99:
+            level = 2
+    elif level == 2:
+        if score > 299:
+            level = 3
+    elif level == 3:
+        if score > 499:
+            level = 4
+    elif level == 4:
+        if score > 799:
+            level = 5
+    elif level == 5:
+        if score > 799:
+            level = 6
+    elif level == 6:
+        if score > 2000:
+            level = 7
+
+    return level
+
+
+# ROTATION CALCULATION FUNCTIONS
+
+def calculate_rotation_num(rotate_anticlockwise, rotation_num):
+    """
+    A simple loop between 0 - 3 that calculates a new rotation
+    number based on a boolean of anti-clockwise
+    """
+
+    # Calculate new rotation index
+    new_rotation = rotation_num
+    if not rotate_anticlockwise:
+        new_rotation += 1
+    else:
+        new_rotation -= 1
+
+    # Do we need to loop?
+    if new_rotation < 0:
+        new_rotation = 3
+    elif new_rotation > 3:
+        new_rotation = 0
+
+    return new_rotation
+
+
+def get_tile_coordinates_global(tile_count_xy, shape_xy):
+    """
+    Returns a x,y of each tile's global location on the grid
+    """
+    # Unpack given variables
+    shape_x, shape_y = shape_xy
+    count_x, count_y = tile_count_xy
+    # Do maths to find each tile's x and y relative to the top right hand corner of the matrix
+    tile_pos_x = shape_x + count_x
+    tile_pos_y = (shape_y - 1) + count_y
+    return tile_pos_x, tile_pos_y
+
+
+def get_rotated_tile(tile_coordinates, center_tile_coordinates, clockwise):
+    """
+    Find the rotated coordinates of a tile relative to the top left hand corner
+    Takes center tile coordinates that it will rotate all other blocks around.
+    Works by finding the relative x, y postions or vectors to the center tile and then
+    them through a rotation matrix (based on which way we want to rotate) and then
+    putting them back in to their correct place relative the top LH corner.
+    """
+    tile_x, tile_y = tile_coordinates
+    center_tile_x, center_tile_y = center_tile_coordinates
+
+    # Find the relative position (vector) of a tile to the center tile (origin)
+    relative_position_x = tile_x - center_tile_x
+    relative_position_y = tile_y - center_tile_y
+
+    # Rotation matrix depending on which way we flip
+    if clockwise:
+        rotation_matrix = [[0, 1],
+                           [-1, 0]]
+    else:
+        rotation_matrix = [[0, -1],
+                           [1, 0]]
+
+    # R x Vr = Vnew // Uses a rotation matrix to find the new x and y positions of our tiles
+    new_postion_x = (rotation_matrix[0][0] * relative_position_x) + (rotation_matrix[0][1] * relative_position_y)
+    new_postion_y = (rotation_matrix[1][0] * relative_position_x) + (rotation_matrix[0][0] * relative_position_y)
+
+    # Put it back into it's correct place on the grid
+    new_postion_x += center_tile_x
+    new_postion_y += center_tile_y
+
+    new_position = new_postion_x, new_postion_y
+    return new_position
+
+
+def minus_xy_array(array_a, array_b):
+    """
+    Function for array A - array B (coordinates).
+    Used mostly for offset calculations.
+    Will return a [x, y] list
+    """
+    a_x_value, a_y_value = array_a[0], array_a[1]
+    b_x_value, b_y_value = array_b[0], array_b[1]
+
+    new_x_value = a_x_value - b_x_value
+    new_y_value = a_y_value - b_y_value
+
+    return new_x_value, new_y_value
+
+
+def locateLargest(matrix):
+    """ Finds the longest length row in matrix and returns it. """
+    largest_num = None
+    list = []
+    for count_y, row in enumerate(matrix):
+        potential_num = 0
+
+        for count_x, num in enumerate(row):
+            if num:
+                potential_num += 1
+        list.append(potential_num)
+    largest_num = max(list)
+    return largest_num
+
+
+def offset_o(old_rotation, new_rotation):
+    """
+    Function to work out the offset of the O block
+    based on old and new rotations. Returns an (x, y) offset.
+    """
+    pos_old = O_OFFSET_DATA[old_rotation]
+    pos_new = O_OFFSET_DATA[new_rotation]
+
+    offset = minus_xy_array(pos_old, pos_new)
+    return offset
+
+
+# ROTATION TABLES
+
+def rotate_matrix(shape, rotate_anticlockwise):
+    """
+    Rotate a shape matrix once, returning a new 4x4 matrix.
+    This is done by rotating each individual tile relative to the center block
+    and putting them back into the new matrix
+    """
+    # Create an empty matrix to load our rotated tiles into
+    new_shape_matrix = [[0, 0, 0, 0],
+                        [0, 0, 0, 0],
+                        [0, 0, 0, 0],
+                        [0, 0, 0, 0]]
+    # Get shape type from center so we can re-color our new shape
+    shape_type = shape[1][1]
+
+    # Count_x, count_y is the x,y coordinates in the matrix
+    # For each tile in the shape
+    for count_y, row in enumerate(shape):
+        for count_x, tile in enumerate(row):
+            # Filter out any 0's to get each tile
+            if tile:
+                # Find the new x and y coordinates of each tile
+                new_x, new_y = get_rotated_tile((count_x, count_y), (1, 1), rotate_anticlockwise)
+                # Add newly rotated tile to our matrix as the shape type
+                new_shape_matrix[new_y][new_x] = shape_type
+    return new_shape_matrix
+
+
+def create_rotation_table():
+    """
+    Works out every rotation of every shape once.
+    Returns a tuple indexed by [shape index][rotation num] of immutable shape matrices,
+    rotation 0 is the shape as it is in SHAPES.
+    """
+    table = []
+    for shape in SHAPES:
+        rotations = [shape]
+        # Rotating clockwise adds 1 to the rotation num (see calculate_rotation_num)
+        for _rotation in range(3):
+            rotations.append(rotate_matrix(rotations[-1], False))
+        table.append(tuple(tuple(tuple(row) for row in matrix) for matrix in rotations))
+    return tuple(table)
+
+
+def get_left_column(shape):
+    """ Returns the column of the left most tile in a shape matrix """
+    return min(count_x for row in shape for count_x, tile in enumerate(row) if tile)
+
+
+def get_shape_profile(shape):
+    """
+    Returns a (column, top row, bottom row) for each column of a shape matrix that has tiles in it.
+    Used for the column heights - the top updates the heights, the bottom finds where it lands
+    """
+    profile = []
+    for count_x in range(len(shape[0])):
+        rows = [count_y for count_y, row in enumerate(shape) if row[count_x]]
+        if rows:
+            profile.append((count_x, min(rows), max(rows)))
+    return tuple(profile)
+
+
+def create_rotation_offsets():
+    """
+    Works out the (x, y) to move each shape by when it rotates.
+    Indexed by [shape index][old rotation][new rotation], only the O block moves
+    (so it doesn't wobble), every other shape rotates in place.
+    """
+    table = []
+    for shape in SHAPES:
+        offsets = []
+        for old_rotation in range(4):
+            if shape[1][1] == 7:
+                offsets.append(tuple(offset_o(old_rotation, new_rotation) for new_rotation in range(4)))
+            else:
+                offsets.append(((0, 0),) * 4)
+        table.append(tuple(offsets))
+    return tuple(table)
+
+
+# Each shape at each rotation, worked out once here so rotating is just a lookup
+ROTATION_TABLE = create_rotation_table()
+# Bit board row masks of each rotation
+ROTATION_MASKS = tuple(tuple(get_shape_masks(matrix) for matrix in rotations) for rotations in ROTATION_TABLE)
+# Left most column of each rotation - used to stop shapes rotating off the left of the board
+ROTATION_LEFT_COLUMN = tuple(tuple(get_left_column(matrix) for matrix in rotations)
+                             for rotations in ROTATION_TABLE)
+ROTATION_OFFSETS = create_rotation_offsets()
+# Top and bottom of each column of each rotation - used with the column heights
+ROTATION_PROFILES = tuple(tuple(get_shape_profile(matrix) for matrix in rotations) for rotations in ROTATION_TABLE)
+
+# How many frames (at 60 frames a second) between each drop for each level
+GRAVITY_FRAMES = {1: 60,
+                  2: 45,
+                  3: 30,
+                  4: 20,
+                  5: 15,
+                  6: 10,
+                  7: 5}
+
+# Seconds a shape can sit on the stack before it locks
+LOCK_DELAY = 0.5
+
+# How many times a second the game logic runs, whatever the frame rate
+LOGIC_HZ = 60
+
+
+class Scheduler:
+    """
+    Runs callbacks at set times of game time. Timers are kept in a heap ordered by when they're due,
+    so moving time on only looks at the timers that are due rather than checking every one each frame.
+    Time only moves on when advance or advance_to is called, so the game runs the same at any frame rate
+    """
+
+    def __init__(self):
+        self.time = 0.0
+        # [due time, order added, callback] - the order keeps timers due at the same time in the order
+        # they were added, and a cancelled timer's callback is set to None
+        self.timers = []
+        self.count = itertools.count()
+
+    def schedule(self, delay, callback):
+        """ Call callback delay seconds of game time from now. Returns the timer so it can be cancelled """
+        timer = [self.time + delay, next(self.count), callback]
+        heapq.heappush(self.timers, timer)
+        return timer
+
+    def cancel(self, timer):
+        """ Stop a timer from firing. It's left in the heap and skipped when it comes up """
+        if timer:
+            timer[2] = None
+
+    def advance(self, delta_time):
+        """ Move time on by delta_time seconds, firing every timer that comes due """
+        self.advance_to(self.time + delta_time)
+
+    def advance_to(self, when):
+        """
+        Move time on to when, firing every timer due by then in order. While a timer's callback runs
+        the time is the time it was due, so a timer scheduled from it is timed from then not from now
+        """
+        while self.timers and self.timers[0][0] <= when:
+            due, _order, callback = heapq.heappop(self.timers)
+            if callback:
+                self.time = due
+                callback()
+        self.time = max(self.time, when)
+
+
+# How the shapes are picked - BAG deals out all 7 shapes in a random order then starts a new bag,
+# so there are never long runs without a shape. RANDOM picks any shape every time
+BAG = "bag"
+RANDOM = "random"
+PIECE_MODES = [BAG, RANDOM]
+
+
+def derive_seed(seed, index):
+    """
+    Make a new seed from a seed and an index (eg. a game or worker number).
+    Hashing them means each index gets its own stream of numbers that doesn't
+    overlap with the others, unlike seed + index
+    """
+    digest = hashlib.sha256("{}-{}".format(seed, index).encode()).digest()
+    return int.from_bytes(digest[:8], "big")
+
+
+class PieceGenerator:
+    """
+    Picks the shapes (as indexes into SHAPES) for a game from its own seeded random,
+    so the same seed always gives the same shapes
+    """
+
+    def __init__(self, seed=None, mode=BAG):
+        """
+        :param seed: the same seed gives the same shapes, a random one is picked if it's None
+        :param mode: BAG or RANDOM
+        """
+        if mode not in PIECE_MODES:
+            raise ValueError("Unknown piece mode {!r}, use one of {}".format(mode, ", ".join(PIECE_MODES)))
+        self.seed = seed if seed is not None else random.getrandbits(64)
+        self.mode = mode
+        self.random = random.Random(self.seed)
+        # Shapes that have been picked but not handed out yet
+        self.queue = collections.deque()
+
+    def fill(self, count):
+        """ Pick shapes until there are at least count waiting """
+        while len(self.queue) < count:
+            if self.mode == BAG:
+                bag = list(range(len(SHAPES)))
+                self.random.shuffle(bag)
+                self.queue.extend(bag)
+            else:
+                self.queue.append(self.random.randrange(len(SHAPES)))
+
+    def next(self):
+        """ Hand out the next shape """
+        self.fill(1)
+        return self.queue.popleft()
+
+    def peek(self, count=1):
+        """ Returns the next count shapes without handing them out """
+        self.fill(count)
+        return list(itertools.islice(self.queue, count))
+
+    def spawn(self, count):
+        """
+        Make count new generators with seeds derived from this one's, eg. one per game or worker.
+        They are the same every time for the same seed and don't share any numbers
+        """
+        return [PieceGenerator(derive_seed(self.seed, index), self.mode) for index in range(count)]
+
+
+class TetrisEngine:
+    """
+    The game itself - the board, the falling shape, the next shape, score and level.
+    Has no arcade code in it so it can be ran without a window,
+    GameView drives one of these and draws it.
+    """
+
+    def __init__(self, seed=None, mode=BAG):
+        """
+        Initializer class. Call setup to start a game
+        :param seed: seed for picking the shapes, the same seed gives the same shapes every game
+        :param mode: how the shapes are picked, BAG or RANDOM
+        """
+        self.seed = seed
+        self.mode = mode
+        self.generator = None
+
+        self.board = None
+        self.bit_board = None
+        self.heights = None
+
+        self.shape = None
+        self.piece = 0
+        self.shape_masks = None
+        self.shape_x = 0
+        self.shape_y = 0
+        self.rotation = 0
+        self.next_shape = None
+        self.next_piece = 0
+        # Where the falling shape will land - worked out when it is needed
+        # and kept until the shape moves, rotates or a new shape is made
+        self.ghost_y = None
+
+        # Cells of the board that have changed since get_dirty was last called, so the
+        # sprites don't all need updating. dirty_rows is how many rows from the top have all changed
+        self.dirty_cells = []
+        self.dirty_rows = 0
+
+        # Game time and the timers for gravity and locking
+        self.scheduler = None
+        self.lock_timer = None
+        self.game_over = False
+
+        self.level = 0
+        self.score = 0
+        # Totals for the game
+        self.lines = 0
+        self.pieces = 0
+
+        # Called with the number of lines every time lines are cleared
+        self.on_lines_cleared = None
+
+    def setup(self):
+        """ Set up the game variables. Call to re-start the game. """
+        # Create a list containing the board (bunch of 0's with some 1's)
+        self.board = new_board(ROW_COUNT, COL_COUNT, False)
+        # Bit board copy of the board used for collisions
+        self.bit_board = new_bit_board(ROW_COUNT)
+        self.heights = [0 for _ in range(COL_COUNT)]
+        # New board - all of it has changed
+        self.dirty_cells = []
+        self.dirty_rows = len(self.board)
+
+        self.scheduler = Scheduler()
+        self.scheduler.schedule(GRAVITY_FRAMES[1] / 60, self.gravity)
+        self.lock_timer = None
+        self.game_over = False
+        self.level = 1
+        self.score = 0
+        self.lines = 0
+        self.pieces = 0
+
+        # Load our shapes
+        self.generator = PieceGenerator(self.seed, self.mode)
+        self.next_piece = self.generator.next()
+        self.next_shape = SHAPES[self.next_piece]
+        self.new_shape()
+
+    def new_shape(self):
+        """ Take the next shape from the generator - create at top of screen"""
+        self.piece = self.next_piece
+        self.shape = ROTATION_TABLE[self.piece][0]
+        self.shape_masks = ROTATION_MASKS[self.piece][0]
+        self.next_piece = self.generator.next()
+        self.next_shape = SHAPES[self.next_piece]
+
+        # Work out the x value - take it from the middle of columns rounded to the left
+        self.shape_x = int(COL_COUNT / 2 - len(self.shape[0]) + 1)
+        self.shape_y = 0
+        self.rotation = 0
+        self.ghost_y = None
+        self.scheduler.cancel(self.lock_timer)
+        self.lock_timer = None
+
+        # Collision checking for game over
+        if check_collision_bits(self.bit_board, self.shape_masks, (self.shape_x, self.shape_y)):
+            self.game_over = True
+
+    def run_until(self, when):
+        """
+        Move the game on to when (seconds since the game started).
+        Returns True if a shape was locked onto the board.
+        """
+        if self.game_over:
+            return False
+        pieces = self.pieces
+        self.scheduler.advance_to(when)
+        return self.pieces != pieces
+
+    def gravity(self):
+        """
+        Gravity timer - moves the shape down a row. If it can't move down, it has landed
+        and it's locked after LOCK_DELAY unless it's moved off the edge before then
+        """
+        if self.game_over:
+            return
+        # The time till the next drop is for the current level
+        self.scheduler.schedule(GRAVITY_FRAMES[self.level] / 60, self.gravity)
+
+        if not check_collision_bits(self.bit_board, self.shape_masks, (self.shape_x, self.shape_y + 1)):
+            self.shape_y += 1
+            # It's falling again - it gets a new lock delay when it lands
+            self.scheduler.cancel(self.lock_timer)
+            self.lock_timer = None
+        elif self.lock_timer is None:
+            self.lock_timer = self.scheduler.schedule(LOCK_DELAY, self.lock)
+
+    def lock(self):
+        """ Lock delay timer - lock the shape if it's still sitting on something """
+        self.lock_timer = None
+        if check_collision_bits(self.bit_board, self.shape_masks, (self.shape_x, self.shape_y + 1)):
+            self.drop()
+
+    def drop(self):
+        """
+        Drop the tetromino down one space.
+        Check for collision:
+        If collision:
+            Join matrices
+            Check if line can be cleared
+            Create a new shape
+        Returns True if the shape was locked onto the board.
+        """
+        if self.game_over:
+            return False
+
+        # Drop shape down by 1
+        self.shape_y += 1
+        # Check if the shape collides with anything on the board
+        if not check_collision_bits(self.bit_board, self.shape_masks, (self.shape_x, self.shape_y)):
+            return False
+
+        self.board = join_matrixes(self.board, self.shape, (self.shape_x, self.shape_y))
+        self.bit_board = join_bits(self.bit_board, self.shape_masks, (self.shape_x, self.shape_y))
+        self.heights = join_heights(self.heights, ROTATION_PROFILES[self.piece][self.rotation],
+                                    (self.shape_x, self.shape_y))
+        self.pieces += 1
+        # The shape's tiles are the only cells that changed
+        bottom_row = 0
+        for count_y, row in enumerate(self.shape):
+            for count_x, tile in enumerate(row):
+                if tile:
+                    self.dirty_cells.append((count_y + self.shape_y - 1, count_x + self.shape_x))
+                    bottom_row = count_y + self.shape_y - 1
+        # Nothing has asked for them in a while (eg. no window) - just mark the whole board
+        if len(self.dirty_cells) > len(self.board) * COL_COUNT:
+            self.dirty_cells = []
+            self.dirty_rows = len(self.board)
+        # Clear every full line at once
+        lines = clear_lines(self.board, self.bit_board)
+        if lines:
+            # Every row above the cleared lines has moved down - the lowest cleared row
+            # can't be lower than the bottom of the shape
+            self.dirty_rows = max(self.dirty_rows, bottom_row + 1)
+            # Every column moves down so work the heights out again
+            self.heights = get_heights(self.bit_board)
+            self.lines_cleared(lines)
+
+        self.new_shape()
+        return True
+
+    def upcoming(self, count):
+        """ Returns the next count shapes (as indexes into SHAPES), starting with next_piece """
+        if count < 1:
+            return []
+        return [self.next_piece] + self.generator.peek(count - 1)
+
+    def get_dirty(self):
+        """
+        Returns (dirty_rows, dirty_cells) - the cells of the board that have changed since
+        this was last called. All of the top dirty_rows rows have changed, and each
+        (row, column) in dirty_cells has. Starts tracking again from now
+        """
+        dirty = self.dirty_rows, self.dirty_cells
+        self.dirty_rows = 0
+        self.dirty_cells = []
+        return dirty
+
+    def landing_y(self):
+        """ The y the falling shape will lock at if it is dropped straight down """
+        # Falling straight down doesn't change where it lands, so only work it out again
+        # after the shape moves or rotates
+        if self.ghost_y is None:
+            self.ghost_y = get_landing_y(self.bit_board, self.heights, self.shape_masks,
+                                         ROTATION_PROFILES[self.piece][self.rotation],
+                                         (self.shape_x, self.shape_y))
+        return self.ghost_y
+
+    def hard_drop(self):
+        """
+        Drop the shape straight to where it lands and lock it.
+        Returns True if the shape was locked onto the board.
+        """
+        if self.game_over:
+            return False
+        self.shape_y = self.landing_y()
+        return self.drop()
+
+    def soft_drop(self):
+        """
+        Move the shape down by 1 then drop it (what the DOWN key does).
+        Returns True if the shape was locked onto the board.
+        """
+        if not self.game_over:
+            new_y = self.shape_y + 1
+            if not check_collision_bits(self.bit_board, self.shape_masks, (self.shape_x, new_y)):
+                self.shape_y = new_y
+        return self.drop()
+
+    def lines_cleared(self, lines):
+        """
+        Called once after a drop clears lines, with the number of lines cleared.
+        Updates the score and level then calls on_lines_cleared
+        """
+        self.lines += lines
+        # Score each line at the level it was cleared on
+        for _line in range(lines):
+            self.score += int(200 / self.level)
+            self.level = check_level(self.level, self.score)
+
+        if self.on_lines_cleared:
+            self.on_lines_cleared(lines)
+
+    def rotate(self, rotate_anticlockwise):
+        """
+        Rotate the shape.
+        Every rotation of every shape is worked out once in ROTATION_TABLE,
+        so this just looks up the new rotation and checks it fits on the board.
+        Returns True if the shape rotated.
+        """
+        if self.game_over:
+            return False
+
+        # Find the new rotation - between 0 and 3
+        new_rotation = calculate_rotation_num(rotate_anticlockwise, self.rotation)
+        new_masks = ROTATION_MASKS[self.piece][new_rotation]
+
+        # Prevent the O shape from wobbling
+        shape_x_offset, shape_y_offset = ROTATION_OFFSETS[self.piece][self.rotation][new_rotation]
+        new_x = self.shape_x + shape_x_offset
+        new_y = self.shape_y + shape_y_offset
+
+        # Check we didn't rotate off the board - if we did, move it back on
+        left_column = new_x + ROTATION_LEFT_COLUMN[self.piece][new_rotation]
+        if left_column < 0:
+            new_x -= left_column
+
+        # Only rotate if it doesn't collide - otherwise the shape stays as it was
+        if check_collision_bits(self.bit_board, new_masks, (new_x, new_y)):
+            return False
+
+        self.shape = ROTATION_TABLE[self.piece][new_rotation]
+        self.shape_masks = new_masks
+        self.rotation = new_rotation
+        self.shape_x = new_x
+        self.shape_y = new_y
+        self.ghost_y = None
+        return True
+
+    def do_action(self, action):
+        """
+        Do one of the player's actions by name (one of KEY_ACTIONS) - used to replay games.
+        Returns what the engine method for it returns
+        """
+        if action == "soft_drop":
+            return self.soft_drop()
+        elif action == "hard_drop":
+            return self.hard_drop()
+        elif action == "left":
+            return self.move(-1)
+        elif action == "right":
+            return self.move(1)
+        elif action == "rotate_anticlockwise":
+            return self.rotate(True)
+        elif action == "rotate_clockwise":
+            return self.rotate(False)
+        raise ValueError("Unknown action {!r}".format(action))
+
+    def move(self, x_value):
+        """
+        :param x_value: delta x - the amount to move the shape across by
+        :return: True if the shape moved
+        """
+        if self.game_over:
+            return False
+
+        # Set the new x value to current + amount to change
+        new_x = self.shape_x + x_value
+        # If not colliding - change position. The bit board walls stop it going past either boundary
+        if check_collision_bits(self.bit_board, self.shape_masks, (new_x, self.shape_y)):
+            return False
+        self.shape_x = new_x
+        self.ghost_y = None
+        return True
+
+
+# Where the recording of the last game played is saved - in the user's home folder,
+# not whatever folder the game was started from
+REPLAY_FILE = os.path.join(os.path.expanduser("~"), ".tetris_2021", "last_game_replay.json")
+
+
+class Recording:
+    """
+    Everything needed to play a game again - the seed and mode for the shapes, how many logic
+    steps a second the game ran at, and every action the player did with the number of
+    logic steps that had been ran when they did it
+    """
+
+    def __init__(self, seed, mode=BAG, logic_hz=LOGIC_HZ, actions=None, steps=0):
+        self.seed = seed
+        self.mode = mode
+        self.logic_hz = logic_hz
+        self.actions = actions if actions is not None else []
+        # How many logic steps the game ran for
+        self.steps = steps
+
+    def add(self, step, action):
+        """ Record action being done after step logic steps """
+        self.actions.append((step, action))
+
+    def save(self, path):
+        """ Save the recording as JSON, making the folder it goes in if needed """
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        with open(path, "w") as file:
+            json.dump({"seed": self.seed, "mode": self.mode, "logic_hz": self.logic_hz, "steps": self.steps,
+                       "actions": self.actions}, file)
+
+
+def load_recording(path):
+    """ Load a recording saved with Recording.save """
+    with open(path) as file:
+        data = json.load(file)
+    return Recording(data["seed"], data["mode"], data["logic_hz"],
+                     [(step, action) for step, action in data["actions"]], data["steps"])
+
+
+def replay_headless(recording):
+    """
+    Play a recording again with no window, as fast as it will go.
+    Returns the TetrisEngine at the end of the game
+    """
+    engine = TetrisEngine(recording.seed, recording.mode)
+    engine.setup()
+    # Run the game on to each action's step and do it, then on to the end.
+    # The time of a step is worked out the same way as GameView.logic_step so it comes out exactly the same
+    for step, action in recording.actions:
+        engine.run_until(step / recording.logic_hz)
+        engine.do_action(action)
+    engine.run_until(recording.steps / recording.logic_hz)
+    return engine